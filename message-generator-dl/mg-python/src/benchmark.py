@@ -0,0 +1,132 @@
+########################################################################
+# Run this script to benchmark the message generation.                 #
+# Without a checkpoint, a small randomly initialized model is used,    #
+# so the benchmark works offline and without training.                 #
+# The results are written as JSON, so they can be compared between     #
+# commits.                                                             #
+########################################################################
+# Accepted env variables:                                              #
+# CHECKPOINT - file path. If set, the checkpoint is benchmarked.       #
+# FULL_SIZE - if set and not empty, the random model has the same      #
+#   dimensions as the real one.                                        #
+# COMPILED_LOOP - see generate.py                                      #
+# BENCHMARK_OUTPUT - file path, where to write the results.            #
+#   Defaults to benchmark-generation.json.                             #
+# BATCH_SIZES - comma-separated integers. Defaults to 1,4,16.          #
+# LENGTHS - comma-separated integers, the message length caps.         #
+#   Defaults to 50,200,1000.                                           #
+# REPEATS - integer, the number of runs per configuration.             #
+#   Defaults to 5.                                                     #
+########################################################################
+
+import json
+import os
+import resource
+import time
+
+process_start_time = time.time()
+
+import numpy as np
+import tensorflow as tf
+
+from stopping import LengthBudget
+from text_generator import TextGenerator
+from text_generator_model import TextGeneratorModel
+from common import *
+
+checkpoint = os.environ["CHECKPOINT"] if "CHECKPOINT" in os.environ else None
+full_size = bool(os.environ["FULL_SIZE"]) if "FULL_SIZE" in os.environ else False
+compiled_loop = bool(os.environ["COMPILED_LOOP"]) if "COMPILED_LOOP" in os.environ else False
+output_file = os.environ["BENCHMARK_OUTPUT"] if "BENCHMARK_OUTPUT" in os.environ else "benchmark-generation.json"
+batch_sizes = [int(size) for size in os.environ.get("BATCH_SIZES", "1,4,16").split(",")]
+lengths = [int(length) for length in os.environ.get("LENGTHS", "50,200,1000").split(",")]
+repeats = int(os.environ["REPEATS"]) if "REPEATS" in os.environ else 5
+
+if checkpoint is not None:
+    with open(os.path.join(checkpoint, "vocab.json"), "r") as file:
+        vocabulary = json.load(file)
+    embedding_dim, rnn_units = EMBEDDING_UNITS, RNN_UNITS
+else:
+    vocabulary = [MASK_TOKEN, OOV_TOKEN] + list("aAbBcCdDeEfFgGhHiIjJkKlLmMnNoOpPqQrRsStTuUvVwWxXyYzZ .,!?") + [MESSAGE_START, MESSAGE_TERMINATOR]
+    embedding_dim, rnn_units = (EMBEDDING_UNITS, RNN_UNITS) if full_size else (32, 130)
+
+char_to_id = tf.keras.layers.StringLookup(vocabulary=vocabulary, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+id_to_char = tf.keras.layers.StringLookup(vocabulary=char_to_id.get_vocabulary(), invert=True, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+
+model = TextGeneratorModel(
+    vocab_size=len(vocabulary),
+    batch_size=BATCH_SIZE,
+    embedding_dim=embedding_dim,
+    rnn_units=rnn_units
+)
+if checkpoint is not None:
+    model.load_weights(os.path.join(checkpoint, "ckpt"))
+else:
+    # The random model would sample the terminator every few dozen characters, making the length caps meaningless.
+    # Its logit is pushed down, so the messages always run up to the cap.
+    terminator_id = int(char_to_id([MESSAGE_TERMINATOR])[0])
+    model.dense.bias[terminator_id].assign(-1e9)
+
+generator = TextGenerator(model, id_to_char, char_to_id, 0.85, compiled_loop)
+generator.warm_up()
+
+startup_time = time.time() - process_start_time
+
+def percentiles(values: list[float]) -> dict:
+    return {f"p{p}": float(np.percentile(values, p)) for p in (50, 95, 99)}
+
+results = []
+for max_length in lengths:
+    # The runaway detection is disabled, so that the messages only stop on their own terminators or at the length limit
+    # (only at the latter with the random model).
+    budget = LengthBudget(max_length, stop_on_runaway=False)
+
+    for batch_size in batch_sizes:
+        latencies = []
+        chars = 0
+
+        # The prompts the benchmark uses are warmed up as well, so that no tracing happens in the timed runs.
+        generator.generate_messages([""] * batch_size, budgets=[LengthBudget(1, stop_on_runaway=False)] * batch_size)
+        if batch_size == 1:
+            next(generator.generate_message_stream("", budget=budget), None)
+
+        for _ in range(repeats):
+            texts, time_taken = generator.generate_messages([""] * batch_size, budgets=[budget] * batch_size)
+            latencies.append(time_taken)
+            chars += sum(len(text) for text in texts)
+
+        result = {
+            "batch_size": batch_size,
+            "max_length": max_length,
+            "latency": percentiles(latencies),
+            "chars_per_second": chars / sum(latencies),
+            "messages_per_second": batch_size * repeats / sum(latencies)
+        }
+
+        # The time to the first chunk is only meaningful for single streamed messages
+        if batch_size == 1:
+            first_chunk_times = []
+            for _ in range(repeats):
+                start = time.time()
+                next(generator.generate_message_stream("", budget=budget), None)
+                first_chunk_times.append(time.time() - start)
+
+            result["time_to_first_chunk"] = percentiles(first_chunk_times)
+
+        print(json.dumps(result))
+        results.append(result)
+
+report = {
+    "model": checkpoint if checkpoint is not None else f"random ({embedding_dim} embedding, {rnn_units} units)",
+    "compiled_loop": compiled_loop,
+    "startup_time": startup_time,
+    # ru_maxrss is in kilobytes on linux
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "results": results
+}
+
+with open(output_file, "w") as file:
+    json.dump(report, file, indent=2)
+
+print(f"Startup time: {startup_time:.3f} s, peak RSS: {report['peak_rss_mb']:.1f} MB")
+print(f"Results written to {output_file}")
@@ -0,0 +1,124 @@
+import json
+import os
+import queue
+import shutil
+import sys
+import threading
+
+import tensorflow as tf
+
+def optimizer_variables(optimizer) -> list:
+    # The legacy optimizers expose their variables through a method
+    variables = optimizer.variables
+    return variables() if callable(variables) else variables
+
+class CheckpointWriter:
+    """
+    Writes checkpoints in a background thread, so that training doesn't wait for the disk.
+    The weights and the optimizer state are copied when a checkpoint is requested and written from a shadow copy
+    of the model, compiled with a shadow copy of the optimizer, so the checkpoints are the same as those
+    written by save_weights of the trained model.
+    Each checkpoint is written into a temporary directory which is renamed once complete,
+    so a crash never leaves a partial ckpt_* directory behind.
+    """
+    def __init__(self, checkpoint_dir: str, vocabulary: list[str], create_model, keep_last: int = None, keep_best: int = 1):
+        """
+        :param create_model: a function returning a new model of the same architecture as the trained one.
+        :param keep_last: if not none, only this many of the latest checkpoints written by this writer are kept,
+            in addition to the keep_best ones with the lowest loss. The others are deleted.
+        """
+        self.checkpoint_dir = checkpoint_dir
+        self.vocabulary = vocabulary
+        self.create_model = create_model
+        self.keep_last = keep_last
+        self.keep_best = keep_best
+
+        # At most one snapshot waits while another one is being written.
+        self.snapshots = queue.Queue(maxsize=1)
+        # The checkpoints written so far, as (path, loss) tuples in order.
+        self.written = []
+        self.shadow_model = None
+        self.optimizer_config = None
+        self.thread = threading.Thread(target=self.run, name="checkpoint-writer", daemon=True)
+        self.thread.start()
+
+    def save(self, name: str, model, loss: float = None):
+        """
+        Copies the weights of the model and the state of its optimizer, if it's compiled,
+        and schedules them to be written into a checkpoint directory with the given name.
+        """
+        optimizer_weights = None
+        if model.optimizer is not None:
+            if self.optimizer_config is None:
+                self.optimizer_config = (type(model.optimizer), model.optimizer.get_config())
+            optimizer_weights = [variable.numpy() for variable in optimizer_variables(model.optimizer)]
+
+        self.snapshots.put((name, model.get_weights(), optimizer_weights, loss))
+
+    def close(self):
+        """
+        Waits for the scheduled checkpoints to be written.
+        """
+        self.snapshots.put(None)
+        self.thread.join()
+
+    def run(self):
+        while True:
+            snapshot = self.snapshots.get()
+            if snapshot is None:
+                break
+
+            name, weights, optimizer_weights, loss = snapshot
+            try:
+                self.write(name, weights, optimizer_weights, loss)
+            except Exception as e:
+                # A failed checkpoint mustn't stop the writer, or training would wait for it forever.
+                sys.stderr.write(f"Failed to write the checkpoint {name}: {e}\n")
+
+    def write(self, name: str, weights: list, optimizer_weights: list, loss: float):
+        if self.shadow_model is None:
+            self.shadow_model = self.create_model()
+
+            if optimizer_weights is not None:
+                optimizer_class, config = self.optimizer_config
+                self.shadow_model.compile(optimizer=optimizer_class.from_config(config))
+
+                # Applying zero gradients creates the slots of the optimizer in the same order as in the trained one.
+                # Their values are overwritten below.
+                variables = self.shadow_model.trainable_variables
+                self.shadow_model.optimizer.apply_gradients(zip([tf.zeros_like(v) for v in variables], variables))
+
+        self.shadow_model.set_weights(weights)
+        if optimizer_weights is not None:
+            for variable, value in zip(optimizer_variables(self.shadow_model.optimizer), optimizer_weights, strict=True):
+                variable.assign(value)
+
+        # The temporary directory doesn't start with ckpt_, so it's never mistaken for a checkpoint.
+        checkpoint = os.path.join(self.checkpoint_dir, name)
+        temp_checkpoint = os.path.join(self.checkpoint_dir, f".tmp_{name}")
+        if os.path.exists(temp_checkpoint):
+            shutil.rmtree(temp_checkpoint)
+        os.mkdir(temp_checkpoint)
+
+        self.shadow_model.save_weights(os.path.join(temp_checkpoint, "ckpt"))
+        with open(os.path.join(temp_checkpoint, "vocab.json"), "w") as file:
+            json.dump(self.vocabulary, file)
+
+        os.rename(temp_checkpoint, checkpoint)
+        self.written.append((checkpoint, loss))
+
+        self.apply_retention()
+
+    def apply_retention(self):
+        if self.keep_last is None:
+            return
+
+        kept = set(path for path, _ in self.written[-self.keep_last:])
+        with_loss = [(path, loss) for path, loss in self.written if loss is not None]
+        kept.update(path for path, _ in sorted(with_loss, key=lambda entry: entry[1])[:self.keep_best])
+
+        for path, _ in [entry for entry in self.written if entry[0] not in kept]:
+            shutil.rmtree(path, ignore_errors=True)
+            print(f"\nRemoved the old checkpoint {path}")
+
+        self.written = [entry for entry in self.written if entry[0] in kept]
@@ -8,3 +8,6 @@ MESSAGE_START = '\u0010'
 MESSAGE_TERMINATOR = '\u0002'
 MASK_TOKEN = '\u0001'
 OOV_TOKEN = '[UNK]'
+
+# Generation is cut off after this many characters if no terminator has been generated.
+MAX_MESSAGE_LENGTH = 1000
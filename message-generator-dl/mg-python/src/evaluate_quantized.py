@@ -0,0 +1,100 @@
+########################################################################
+# Run this script to compare a reduced-precision variant written by    #
+# export.py against the original model.                                #
+# Prints the per-character perplexity and the time per character of   #
+# both models on the dataset.                                          #
+########################################################################
+# Accepted env variables:                                              #
+# CHECKPOINT - file path                                               #
+# TFLITE_MODEL - file path                                             #
+# DATASET - file path, a dataset in the format used by train.py        #
+# EVAL_LINES - integer, the number of lines to evaluate on.            #
+#   Defaults to 200.                                                   #
+########################################################################
+
+import json
+import math
+import os
+import time
+
+import tensorflow as tf
+
+from served_model import TFLiteGeneratorModel
+from text_generator_model import TextGeneratorModel
+from common import *
+
+if ("CHECKPOINT" not in os.environ or "TFLITE_MODEL" not in os.environ or "DATASET" not in os.environ):
+    print("CHECKPOINT, TFLITE_MODEL or DATASET environment variables are not set")
+    exit(1)
+checkpoint = os.environ["CHECKPOINT"]
+eval_lines = int(os.environ["EVAL_LINES"]) if "EVAL_LINES" in os.environ else 200
+
+with open(os.path.join(checkpoint, "vocab.json"), "r") as file:
+    vocabulary = json.load(file)
+
+char_to_id = tf.keras.layers.StringLookup(vocabulary=vocabulary, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+
+float_model = TextGeneratorModel(
+    vocab_size=len(vocabulary),
+    batch_size=BATCH_SIZE,
+    embedding_dim=EMBEDDING_UNITS,
+    rnn_units=RNN_UNITS
+)
+float_model.load_weights(os.path.join(checkpoint, "ckpt"))
+
+quantized_model = TFLiteGeneratorModel(os.environ["TFLITE_MODEL"])
+
+if quantized_model.vocabulary != vocabulary:
+    print("The variant has been exported from a checkpoint with a different vocabulary")
+    exit(1)
+
+def evaluate(model, lines: list[str]) -> (float, float):
+    """
+    :return: A tuple of the per-character perplexity and the time in seconds per character.
+    """
+    total_loss = 0.0
+    total_chars = 0
+    total_time = 0.0
+    # The input lengths the model has already been called with
+    warmed_up = set()
+
+    for line in lines:
+        ids = char_to_id(tf.strings.unicode_split([line], 'UTF-8')).to_tensor()
+        inputs, targets = ids[:, :-1], ids[:, 1:]
+
+        # Training starts with zero states, so the evaluation does too.
+        states = (
+            [tf.zeros([1, model.rnn1.units]), tf.zeros([1, model.rnn1.units])],
+            [tf.zeros([1, model.rnn2.units]), tf.zeros([1, model.rnn2.units])]
+        )
+
+        # The first call with a new length traces the float model, which mustn't be counted as the inference time.
+        # Both models are warmed up the same way, so the comparison stays fair.
+        if inputs.shape[1] not in warmed_up:
+            model(inputs, states, True, False)
+            warmed_up.add(inputs.shape[1])
+
+        start = time.time()
+        logits, _ = model(inputs, states, True, False)
+        total_time += time.time() - start
+
+        # Padding is not counted
+        mask = tf.cast(tf.not_equal(targets, 0), tf.float32)
+        losses = tf.nn.sparse_softmax_cross_entropy_with_logits(targets, logits)
+
+        total_loss += float(tf.reduce_sum(losses * mask))
+        total_chars += int(tf.reduce_sum(mask))
+
+    return math.exp(total_loss / total_chars), total_time / total_chars
+
+with open(os.environ["DATASET"], "r", encoding="utf-8") as file:
+    lines = [line.rstrip("\n") for _, line in zip(range(eval_lines), file)]
+lines = [line for line in lines if len(line) > 1]
+
+float_perplexity, float_time = evaluate(float_model, lines)
+quantized_perplexity, quantized_time = evaluate(quantized_model, lines)
+
+print(f"Evaluated on {len(lines)} lines")
+print(f"Float model:     perplexity {float_perplexity:.4f}, {float_time * 1000:.4f} ms per character")
+print(f"Quantized model: perplexity {quantized_perplexity:.4f}, {quantized_time * 1000:.4f} ms per character")
+print(f"Perplexity change: {(quantized_perplexity / float_perplexity - 1) * 100:+.2f}%, speedup: {float_time / quantized_time:.2f}x")
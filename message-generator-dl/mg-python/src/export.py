@@ -0,0 +1,53 @@
+########################################################################
+# Run this script to export a checkpoint into a ready-to-serve         #
+# artifact, which generate.py can load with the SAVED_MODEL variable.  #
+########################################################################
+# Accepted env variables:                                              #
+# CHECKPOINT - file path                                               #
+# EXPORT_DIR - file path, the directory to write the artifact into     #
+# QUANTIZE - "float16" or "int8". If set, a reduced-precision TFLite   #
+#   variant is additionally written into EXPORT_DIR, which generate.py #
+#   can load with the TFLITE_MODEL variable.                           #
+########################################################################
+
+import json
+import os
+
+import tensorflow as tf
+
+from served_model import ExportedGeneratorModel, convert_to_tflite
+from text_generator_model import TextGeneratorModel
+from common import *
+
+if ("CHECKPOINT" not in os.environ or "EXPORT_DIR" not in os.environ):
+    print("CHECKPOINT or EXPORT_DIR environment variables are not set")
+    exit(1)
+checkpoint = os.environ["CHECKPOINT"]
+export_dir = os.environ["EXPORT_DIR"]
+quantization = os.environ["QUANTIZE"] if "QUANTIZE" in os.environ else None
+
+with open(os.path.join(checkpoint, "vocab.json"), "r") as file:
+    vocabulary = json.load(file)
+
+model = TextGeneratorModel(
+    vocab_size=len(vocabulary),
+    batch_size=BATCH_SIZE,
+    embedding_dim=EMBEDDING_UNITS,
+    rnn_units=RNN_UNITS
+)
+model.load_weights(os.path.join(checkpoint, "ckpt"))
+
+exported = ExportedGeneratorModel(model, vocabulary)
+tf.saved_model.save(exported, export_dir)
+
+print(f"Exported {checkpoint} to {export_dir}")
+
+if quantization is not None:
+    tflite_file = os.path.join(export_dir, f"model-{quantization}.tflite")
+
+    with open(tflite_file, "wb") as file:
+        file.write(convert_to_tflite(exported, quantization))
+    with open(tflite_file + ".json", "w") as file:
+        json.dump({"vocabulary": vocabulary, "units": [model.rnn1.units, model.rnn2.units]}, file)
+
+    print(f"Exported the {quantization} variant to {tflite_file}")
@@ -4,56 +4,446 @@
 ########################################################################
 # Accept env variables:                                                #
 # CHECKPOINT - file path                                               #
+# SAVED_MODEL - file path of an artifact written by export.py. If set, #
+#   it's served instead of CHECKPOINT.                                 #
+# TFLITE_MODEL - file path of a reduced-precision variant written by   #
+#   export.py. If set, it's served instead of CHECKPOINT.              #
+# PROTOCOL - "text" (default), "batch" or "framed". In the framed      #
+#   mode, requests and responses are length-prefixed JSON frames       #
+#   carrying request ids; see protocol.py. Pending requests are        #
+#   batched. The batch mode is the text mode with BATCH:: lines.       #
+# COMPILED_LOOP - if set and not empty, each message is decoded in a   #
+#   single compiled graph instead of a python loop.                    #
+# WORKERS - integer, the number of generator threads in the framed     #
+#   mode. Defaults to 1.                                               #
+# INTRA_OP_THREADS, INTER_OP_THREADS - integers, the sizes of the TF   #
+#   thread pools. By default, the cores are split among the workers.   #
+# CPU_AFFINITY - comma-separated list of cores the process may use.    #
+# PREFIX_CACHE_MB - integer. If set, the states reached after the      #
+#   starting phrases are cached, using up to this many megabytes.      #
+#   The random initial state is then added after the phrase instead of #
+#   before it, which changes the output distribution of non-empty      #
+#   phrases. Without explicit ranges, a narrower one is added to them  #
+#   (see text_generator.CACHED_PREFIX_STATE_RANGES).                   #
+# METRICS_FILE - file path. If set, the time spent in each phase of    #
+#   the requests, the queue depth, the tf.function retracing events,   #
+#   the startup time and the latency of the first request are          #
+#   periodically written there in the Prometheus text format.          #
+# METRICS_PORT - integer. If set, the same metrics are served over     #
+#   http on localhost.                                                 #
+# METRICS_INTERVAL - seconds between the writes of METRICS_FILE.       #
+#   Defaults to 10.                                                    #
+# PROFILE_DIR - directory path. If set, sending SIGUSR1 to the process #
+#   starts the tensorflow profiler, and sending it again stops it.     #
+# PREGENERATE_POOL_SIZE - integer. If set, up to this many messages    #
+#   per params object are generated in advance while the service is    #
+#   idle, and the requests with the same params are answered from      #
+#   this pool. Streaming and BATCH:: requests are always generated.    #
+# PREGENERATE_PARAMS - JSON list of the params objects (see below),    #
+#   each with a "phrase" field, to pool messages for. Defaults to the  #
+#   empty starting phrase with the default parameters.                 #
+# RELOAD_COMMANDS - if set and not empty, reload commands are also     #
+#   accepted in the text mode. Only set it if the input never carries  #
+#   user text: any line starting with RELOAD:: then loads a model.     #
+#                                                                      #
+# The model can be replaced without restarting with a reload command,  #
+# see below. The new model is loaded and warmed up in the background,  #
+# then swapped in; it must have the same vocabulary size.              #
 ########################################################################
 
+import contextlib
 import json
 import os
 import sys
+from time import time as timer
+
+process_start_time = timer()
 
 import tensorflow as tf
 
+from hot_reload import ModelReloader
+import metrics as instrumentation
+from metrics import metrics
+from prefix_cache import PrefixStateCache
+from pregeneration import PregenerationPool
+from protocol import FramedChannel
+from sampling import SamplingParams
+from served_model import load_generator_model
+from stopping import LengthBudget
 from text_generator import TextGenerator
-from text_generator_model import TextGeneratorModel
+from worker_pool import WorkerPool
 from common import *
 
-if ("CHECKPOINT" not in os.environ):
-    print("CHECKPOINT environment variable is not set")
+if ("CHECKPOINT" not in os.environ and "SAVED_MODEL" not in os.environ and "TFLITE_MODEL" not in os.environ):
+    print("CHECKPOINT, SAVED_MODEL or TFLITE_MODEL environment variable is not set")
     exit(1)
-checkpoint = os.environ["CHECKPOINT"]
+protocol = os.environ["PROTOCOL"] if "PROTOCOL" in os.environ else "text"
+compiled_loop = bool(os.environ["COMPILED_LOOP"]) if "COMPILED_LOOP" in os.environ else False
+workers = int(os.environ["WORKERS"]) if "WORKERS" in os.environ else 1
+prefix_cache_mb = int(os.environ["PREFIX_CACHE_MB"]) if "PREFIX_CACHE_MB" in os.environ else None
+pregenerate_pool_size = int(os.environ["PREGENERATE_POOL_SIZE"]) if "PREGENERATE_POOL_SIZE" in os.environ else None
+pregenerate_params = json.loads(os.environ["PREGENERATE_PARAMS"]) if "PREGENERATE_PARAMS" in os.environ else [{"phrase": ""}]
+reload_commands = bool(os.environ["RELOAD_COMMANDS"]) if "RELOAD_COMMANDS" in os.environ else False
+
+instrumentation.configure_from_environment("generator")
+
+# The threading settings must be applied before tensorflow initializes its runtime.
+if "CPU_AFFINITY" in os.environ:
+    os.sched_setaffinity(0, [int(core) for core in os.environ["CPU_AFFINITY"].split(",")])
+cores = len(os.sched_getaffinity(0))
+
+if "INTRA_OP_THREADS" in os.environ:
+    tf.config.threading.set_intra_op_parallelism_threads(int(os.environ["INTRA_OP_THREADS"]))
+elif workers > 1:
+    # Every worker runs its own ops concurrently, so each op gets its share of the cores.
+    tf.config.threading.set_intra_op_parallelism_threads(max(1, cores // workers))
+if "INTER_OP_THREADS" in os.environ:
+    tf.config.threading.set_inter_op_parallelism_threads(int(os.environ["INTER_OP_THREADS"]))
+
+# The default temperature, used unless a request specifies its own
+temperature = 0.85
+
+prefix_cache = PrefixStateCache(prefix_cache_mb * 1024 * 1024) if prefix_cache_mb is not None else None
+models_loaded = 0
+
+def load_generator(source: dict) -> TextGenerator:
+    """
+    Loads a model and warms up a generator using it.
+    :param source: a dict containing one of the "tflite_model", "saved_model" and "checkpoint" paths,
+        in the same order of precedence as the environment variables.
+    """
+    global models_loaded
+
+    model, vocabulary = load_generator_model(source)
+
+    char_to_id = tf.keras.layers.StringLookup(vocabulary=vocabulary, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+    id_to_char = tf.keras.layers.StringLookup(vocabulary=char_to_id.get_vocabulary(), invert=True, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+
+    # The same path may be reloaded after being overwritten, so every loaded model gets its own id in the prefix cache.
+    models_loaded += 1
+    model_id = f"{source.get('tflite_model') or source.get('saved_model') or source.get('checkpoint')}#{models_loaded}"
+
+    generator = TextGenerator(model, id_to_char, char_to_id, temperature, compiled_loop, prefix_cache, model_id)
+    generator.warm_up()
+
+    return generator
+
+def validate_generator(new_generator: TextGenerator):
+    if new_generator.vocab_size != generator.vocab_size:
+        raise ValueError(f"The new model has {new_generator.vocab_size} characters in its vocabulary, but the current one has {generator.vocab_size}")
+
+def swap_generator(new_generator: TextGenerator):
+    global generator
+    generator = new_generator
+
+    # The pooled messages were generated by the old model
+    if pregenerated is not None:
+        pregenerated.clear()
+
+    metrics.increment("reloads")
+    sys.stderr.write(f"Reloaded the model: {new_generator.model_id}\n")
+
+generator = load_generator({
+    "tflite_model": os.environ.get("TFLITE_MODEL"),
+    "saved_model": os.environ.get("SAVED_MODEL"),
+    "checkpoint": os.environ.get("CHECKPOINT")
+})
+reloader = ModelReloader(load_generator, validate_generator, swap_generator)
+
+pregenerated = None
+if pregenerate_pool_size is not None:
+    pregenerated = PregenerationPool(lambda: generator, pregenerate_params, pregenerate_pool_size, temperature)
+    pregenerated.start()
+    metrics.add_collector(lambda: {"pregenerated_" + key: value for key, value in pregenerated.stats().items()})
+
+def live_request():
+    """
+    Must wrap the handling of every request, so that the pregeneration gives way to it.
+    """
+    return pregenerated.live_request() if pregenerated is not None else contextlib.nullcontext()
+
+if prefix_cache is not None:
+    metrics.add_collector(lambda: {"prefix_cache_hits": prefix_cache.hits, "prefix_cache_misses": prefix_cache.misses})
+
+startup_time = timer() - process_start_time
+metrics.set_gauge("startup_seconds", startup_time)
+sys.stderr.write(f"Startup time: {startup_time} s\n")
+
+def validate_request(request: dict):
+    """
+    Checks a params object containing a "phrase", so that an invalid request can be answered on its own
+    instead of failing the batch it would end up in.
+    :raises ValueError: if the request is invalid.
+    """
+    if not isinstance(request.get("phrase"), str):
+        raise ValueError("The request has no phrase")
+
+    try:
+        SamplingParams.from_dict(request, temperature)
+        LengthBudget.from_dict(request)
+    except TypeError as e:
+        raise ValueError(f"Invalid request: {e}")
+
+first_request_reported = False
+def report_request(time_taken: float):
+    """
+    Reports the latency of the first request after startup.
+    """
+    global first_request_reported
+    if not first_request_reported:
+        first_request_reported = True
+        metrics.set_gauge("first_request_latency_seconds", time_taken)
+        sys.stderr.write(f"First request latency: {time_taken} s\n")
+
+if protocol == "framed":
+    # Requests are {"id": ..., "phrase": ..., "ranges": ..., "stream": ...} frames, all but id and phrase being optional.
+    # Requests can also contain the sampling parameters: temperature, top_k, top_p and repetition_penalty,
+    # and the budget: max_length, deadline_ms and stop_on_runaway (see stopping.LengthBudget).
+    # The deadline is counted from the arrival of the request, so it includes the time the request spends queued.
+    # Responses are {"id": ..., "text": ..., "time": ..., "queue_depth": ...} frames.
+    # Requests are distributed among the workers; the requests that arrive while a worker is busy
+    # are generated together in its next batch.
+    # Streaming requests are generated one by one instead: each chunk of the message is sent as soon as it's ready
+    # in a {"id": ..., "partial": ...} frame, and the final response additionally contains "first_chunk_time".
+    # {"id": ..., "command": "reload", "checkpoint": ...} frames (or "saved_model" / "tflite_model" instead of "checkpoint")
+    # replace the model, and are answered with {"id": ..., "reloaded": true} or {"id": ..., "error": ...}.
+    # Responses to the requests answered from the pregeneration pool additionally contain "pregenerated": true.
+    channel = FramedChannel()
+
+    def handle_batch(batch: list):
+        with live_request():
+            generate_batch(batch)
+
+    def respond(request: dict, response: dict):
+        """
+        Writes the final response to a request and marks it as answered,
+        so that it doesn't get an error as well if the rest of its batch fails.
+        """
+        channel.write(response)
+        request["answered"] = True
 
-# Load the vocabulary
-with open(os.path.join(checkpoint, "vocab.json"), "r") as file:
-    vocabulary = json.load(file)
+    def report_error(request: dict, error: str):
+        if not request.get("answered"):
+            channel.write({"id": request["id"], "error": error})
 
-char_to_id = tf.keras.layers.StringLookup(vocabulary=vocabulary, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
-id_to_char = tf.keras.layers.StringLookup(vocabulary=char_to_id.get_vocabulary(), invert=True, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+    def generate_batch(batch: list):
+        # A reload may swap the generator at any moment; the whole batch is handled by the one it started with.
+        current_generator = generator
 
-model = TextGeneratorModel(
-    vocab_size=len(char_to_id.get_vocabulary()),
-    batch_size=BATCH_SIZE,
-    embedding_dim=EMBEDDING_UNITS,
-    rnn_units=RNN_UNITS
-)
-# Load the model
-model.load_weights(os.path.join(checkpoint, "ckpt"))
+        for request in [request for request in batch if request.get("stream")]:
+            start_time = timer()
+            first_chunk_time = None
+            text = ""
 
-generator = TextGenerator(model, id_to_char, char_to_id, 0.85)
+            for chunk in current_generator.generate_message_stream(
+                request["phrase"],
+                request.get("ranges"),
+                SamplingParams.from_dict(request, temperature),
+                budget=LengthBudget.from_dict(request)
+            ):
+                if first_chunk_time is None:
+                    first_chunk_time = timer() - start_time
 
-sys.stderr.write("Generating. Type starting phrases to generate inputs.")
+                text += chunk
+                channel.write({"id": request["id"], "partial": chunk})
+
+            report_request(timer() - start_time)
+            respond(request, {
+                "id": request["id"],
+                "text": request["phrase"] + text,
+                "time": timer() - start_time,
+                "first_chunk_time": first_chunk_time if first_chunk_time is not None else timer() - start_time,
+                "queue_depth": pool.queue_depth()
+            })
+
+        # Pooled messages are sent right away; only the rest are generated.
+        start_time = timer()
+        pending = []
+        for request in [request for request in batch if not request.get("stream")]:
+            text = pregenerated.take(request) if pregenerated is not None else None
+            if text is None:
+                pending.append(request)
+                continue
+
+            report_request(timer() - start_time)
+            respond(request, {
+                "id": request["id"],
+                "text": request["phrase"] + text,
+                "time": timer() - start_time,
+                "queue_depth": pool.queue_depth(),
+                "pregenerated": True
+            })
+        batch = pending
+
+        if len(batch) > 0:
+            phrases = [request["phrase"] for request in batch]
+            texts, time = current_generator.generate_messages(
+                phrases,
+                [request.get("ranges") for request in batch],
+                [SamplingParams.from_dict(request, temperature) for request in batch],
+                [LengthBudget.from_dict(request) for request in batch]
+            )
+            report_request(time)
+
+            for request, phrase, text in zip(batch, phrases, texts):
+                respond(request, {
+                    "id": request["id"],
+                    "text": phrase + text,
+                    "time": time,
+                    "queue_depth": pool.queue_depth()
+                })
+
+    # If a batch fails, each of its requests that hasn't been answered yet is answered with {"id": ..., "error": ...}.
+    pool = WorkerPool(handle_batch, workers, BATCH_SIZE, report_error)
+    pool.start()
+    metrics.add_collector(lambda: {"queue_depth": pool.queue_depth()})
+
+    sys.stderr.write(f"Generating in the framed mode with {workers} workers.")
+
+    while True:
+        request = channel.read()
+        if request is None:
+            break
+        # The deadlines include the time the request spends queued
+        request["received_at"] = timer()
+
+        if request.get("command") == "reload":
+            reloader.reload(request, lambda error, request_id=request["id"]: channel.write(
+                {"id": request_id, "reloaded": True} if error is None else {"id": request_id, "error": error}
+            ))
+            continue
+
+        metrics.increment("requests")
+
+        # Invalid requests are answered right away, without failing the batch they would end up in.
+        try:
+            validate_request(request)
+        except ValueError as e:
+            channel.write({"id": request["id"], "error": str(e)})
+            continue
+
+        pool.submit(request)
+
+    pool.close()
+    exit(0)
+
+def write_error(error: str):
+    """
+    Answers a request of the text modes that couldn't be handled. The response keeps the usual three-line format,
+    so that the caller stays in sync: an `ERROR::` line with the message, a zero time and an empty line.
+    """
+    sys.stderr.write(f"Failed to handle a request: {error}\n")
+    with metrics.time("write"):
+        print("ERROR::" + " ".join(error.split()))
+        print("0 s")
+        print("")
+
+def parse_batch(line: str) -> tuple:
+    """
+    Parses a batch object (see below).
+    :return: A tuple of the phrases, the state ranges, the sampling parameters and the budgets, the latter three possibly none.
+    :raises ValueError: if the batch object is invalid.
+    """
+    try:
+        batch = json.loads(line)
+        phrases = batch["phrases"]
+        ranges = batch.get("ranges")
+        params = batch.get("params")
+
+        if not isinstance(phrases, list) or not all(isinstance(phrase, str) for phrase in phrases):
+            raise ValueError("phrases must be a list of strings")
+        for name, values in (("ranges", ranges), ("params", params)):
+            if values is not None and (not isinstance(values, list) or len(values) != len(phrases)):
+                raise ValueError(f"{name} must be a list with an entry per phrase")
+
+        sampling_params = [SamplingParams.from_dict(p or {}, temperature) for p in params] if params is not None else None
+        budgets = [LengthBudget.from_dict(p or {}) for p in params] if params is not None else None
+    except (KeyError, TypeError, AttributeError) as e:
+        raise ValueError(f"Invalid batch object: {e}")
+
+    return phrases, ranges, sampling_params, budgets
+
+if protocol == "batch":
+    sys.stderr.write("Generating. Type starting phrases to generate inputs, or BATCH:: followed by a batch object.")
+else:
+    sys.stderr.write("Generating. Type starting phrases to generate inputs.")
 
 while True:
     phrase = input()
 
+    # If reload commands are enabled and the line starts with `RELOAD::`, treat the rest as a reload object:
+    # {"checkpoint": ...}, or {"saved_model": ...} / {"tflite_model": ...}. Nothing is printed; the outcome is reported to stderr.
+    # Otherwise, such lines are starting phrases like any other.
+    if reload_commands and phrase.startswith("RELOAD::"):
+        try:
+            source = json.loads(phrase[len("RELOAD::"):])
+        except ValueError as e:
+            sys.stderr.write(f"Invalid reload command: {e}\n")
+            continue
+
+        reloader.reload(source, lambda error: None)
+        continue
+
+    metrics.increment("requests")
+
+    # In the batch mode, if the line starts with `BATCH::`, treat the rest as a batch object:
+    # {"phrases": [...], "ranges": [...], "params": [...]}. Params are optional params objects (see below), one per phrase.
+    # All phrases are generated at once; one message is printed per line, in order, followed by the total time.
+    # An invalid batch object is answered with an error (see write_error).
+    if protocol == "batch" and phrase.startswith("BATCH::"):
+        try:
+            with metrics.time("parse"):
+                phrases, ranges, sampling_params, budgets = parse_batch(phrase[len("BATCH::"):])
+        except ValueError as e:
+            write_error(str(e))
+            continue
+
+        with live_request():
+            texts, time = generator.generate_messages(phrases, ranges, sampling_params, budgets)
+        report_request(time)
+        with metrics.time("write"):
+            for phrase, text in zip(phrases, texts):
+                print(phrase + text)
+            print(f"{time} s")
+            print("")
+        continue
+
     # If the phrase contains a `PARAMS::` string, remove it and treat the following as a params object.
-    if "PARAMS::" in phrase:
-        phrase, params = phrase.split("PARAMS::")
-        params = json.loads(params)
-        state_random_ranges = params["ranges"]
-    else:
-        state_random_ranges = None
-
-
-    text, time = generator.generate_message(phrase, state_random_ranges)
-    print(phrase + text)
-    print(f"{time} s")
-    print("")
+    # Params objects contain the state ranges and, optionally, the sampling parameters:
+    # temperature, top_k, top_p and repetition_penalty, and the budget: max_length, deadline_ms and stop_on_runaway.
+    # When the deadline passes, the part of the message generated so far is returned.
+    # An invalid params object is answered with an error (see write_error).
+    try:
+        with metrics.time("parse"):
+            if "PARAMS::" in phrase:
+                phrase, params = phrase.split("PARAMS::")
+                params = json.loads(params)
+                if not isinstance(params, dict):
+                    raise ValueError("The params must be an object")
+                validate_request(dict(params, phrase=phrase))
+
+                state_random_ranges = params.get("ranges")
+                sampling_params = SamplingParams.from_dict(params, temperature)
+                budget = LengthBudget.from_dict(params)
+            else:
+                params = {}
+                state_random_ranges = None
+                sampling_params = None
+                budget = None
+    except ValueError as e:
+        write_error(str(e))
+        continue
+
+    with live_request():
+        start_time = timer()
+        text = pregenerated.take(dict(params, phrase=phrase)) if pregenerated is not None else None
+
+        if text is not None:
+            time = timer() - start_time
+        else:
+            text, time = generator.generate_message(phrase, state_random_ranges, sampling_params, budget)
+    report_request(time)
+    with metrics.time("write"):
+        print(phrase + text)
+        print(f"{time} s")
+        print("")
@@ -0,0 +1,204 @@
+########################################################################
+# Run this script to generate messages and pick the best ones          #
+# according to the rating model, both models running in this process.  #
+# Each request generates several candidates in a single batch, rates   #
+# all of them in a single call and returns the best rated one.         #
+########################################################################
+# Accepted env variables:                                              #
+# CHECKPOINT, SAVED_MODEL, TFLITE_MODEL - the generator model, see     #
+#   generate.py.                                                       #
+# RATING_SOURCE - directory path containing the python files of the    #
+#   rating subproject.                                                 #
+# MODEL_SAVEFILE, VOCAB_SAVEFILE - file pathes of the rating model.    #
+# RATING_SAVED_MODEL - file path of an artifact written by the export  #
+#   script of the rating subproject. If set, it's served instead of    #
+#   MODEL_SAVEFILE and VOCAB_SAVEFILE.                                 #
+# CANDIDATES - integer, the number of candidates generated per         #
+#   message unless a request specifies its own. Defaults to 4.         #
+# PROTOCOL - "text" (default) or "framed", see generate.py.            #
+# COMPILED_LOOP - see generate.py.                                     #
+########################################################################
+
+import json
+import os
+import sys
+from time import time as timer
+
+process_start_time = timer()
+
+import tensorflow as tf
+
+from protocol import FramedChannel
+from rating_bridge import import_rating_module
+from sampling import SamplingParams
+from served_model import load_generator_model
+from stopping import LengthBudget
+from text_generator import TextGenerator
+from worker_pool import WorkerPool
+from common import *
+
+if ("CHECKPOINT" not in os.environ and "SAVED_MODEL" not in os.environ and "TFLITE_MODEL" not in os.environ):
+    print("CHECKPOINT, SAVED_MODEL or TFLITE_MODEL environment variable is not set")
+    exit(1)
+if ("RATING_SOURCE" not in os.environ or ("RATING_SAVED_MODEL" not in os.environ and ("MODEL_SAVEFILE" not in os.environ or "VOCAB_SAVEFILE" not in os.environ))):
+    print("RATING_SOURCE, and RATING_SAVED_MODEL or MODEL_SAVEFILE and VOCAB_SAVEFILE environment variables are not set")
+    exit(1)
+protocol = os.environ["PROTOCOL"] if "PROTOCOL" in os.environ else "text"
+compiled_loop = bool(os.environ["COMPILED_LOOP"]) if "COMPILED_LOOP" in os.environ else False
+default_candidates = int(os.environ["CANDIDATES"]) if "CANDIDATES" in os.environ else 4
+
+model, vocabulary = load_generator_model({
+    "tflite_model": os.environ.get("TFLITE_MODEL"),
+    "saved_model": os.environ.get("SAVED_MODEL"),
+    "checkpoint": os.environ.get("CHECKPOINT")
+})
+
+char_to_id = tf.keras.layers.StringLookup(vocabulary=vocabulary, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+id_to_char = tf.keras.layers.StringLookup(vocabulary=char_to_id.get_vocabulary(), invert=True, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+
+# The default temperature, used unless a request specifies its own
+temperature = 0.85
+
+generator = TextGenerator(model, id_to_char, char_to_id, temperature, compiled_loop)
+generator.warm_up()
+
+# The rating model comes with its own vocabulary and is warmed up by the loader
+rating_models = import_rating_module(os.environ["RATING_SOURCE"], "served_model")
+normalize_message = import_rating_module(os.environ["RATING_SOURCE"], "text_rater").normalize_message
+rater, _ = rating_models.load_rater({
+    "saved_model": os.environ.get("RATING_SAVED_MODEL"),
+    "model_savefile": os.environ.get("MODEL_SAVEFILE"),
+    "vocab_savefile": os.environ.get("VOCAB_SAVEFILE")
+})
+
+sys.stderr.write(f"Startup time: {timer() - process_start_time} s\n")
+
+def validate_request(request: dict):
+    """
+    Checks a params object containing a "phrase", so that an invalid request can be answered on its own
+    instead of failing the batch it would end up in.
+    :raises ValueError: if the request is invalid.
+    """
+    if not isinstance(request.get("phrase"), str):
+        raise ValueError("The request has no phrase")
+    if not isinstance(request.get("candidates", default_candidates), int):
+        raise ValueError("candidates must be an integer")
+
+    try:
+        SamplingParams.from_dict(request, temperature)
+        LengthBudget.from_dict(request)
+    except TypeError as e:
+        raise ValueError(f"Invalid request: {e}")
+
+def generate_best(requests: list[dict]) -> list[tuple]:
+    """
+    Generates the candidates of all requests in a single batch, rates all of them in a single call,
+    and picks the best rated candidate of each request.
+    :param requests: a list of params objects with the "phrase" field (see below).
+    :return: A list of tuples of the best message, including the starting phrase, and its rating, one per request.
+    """
+    phrases, ranges, sampling_params, budgets, owners = [], [], [], [], []
+    for i, request in enumerate(requests):
+        count = max(1, request.get("candidates", default_candidates))
+
+        phrases += [request["phrase"]] * count
+        ranges += [request.get("ranges")] * count
+        sampling_params += [SamplingParams.from_dict(request, temperature)] * count
+        budgets += [LengthBudget.from_dict(request)] * count
+        owners += [i] * count
+
+    texts, _ = generator.generate_messages(phrases, ranges, sampling_params, budgets)
+    messages = [phrase + text for phrase, text in zip(phrases, texts)]
+    # The rater has only seen normalized messages, but the original ones are returned
+    ratings = rater.rate_bucketed([normalize_message(message) for message in messages])
+
+    best = [None] * len(requests)
+    for owner, message, rating in zip(owners, messages, ratings):
+        if best[owner] is None or rating > best[owner][1]:
+            best[owner] = (message, float(rating))
+
+    return best
+
+if protocol == "framed":
+    # Requests are {"id": ..., "phrase": ..., "candidates": ...} frames; the other fields are the same as in generate.py.
+    # Responses are {"id": ..., "text": ..., "rating": ..., "time": ..., "queue_depth": ...} frames.
+    # The requests that arrive while a batch is being handled are handled together in the next one.
+    channel = FramedChannel()
+
+    def handle_batch(batch: list):
+        start_time = timer()
+        results = generate_best(batch)
+        time_taken = timer() - start_time
+
+        for request, (text, rating) in zip(batch, results):
+            channel.write({
+                "id": request["id"],
+                "text": text,
+                "rating": rating,
+                "time": time_taken,
+                "queue_depth": pool.queue_depth()
+            })
+
+    # Each request turns into several candidates, so fewer requests fit into a batch.
+    # If a batch fails, each of its requests is answered with {"id": ..., "error": ...}.
+    pool = WorkerPool(
+        handle_batch, 1, max(1, BATCH_SIZE // default_candidates),
+        lambda request, error: channel.write({"id": request["id"], "error": error})
+    )
+    pool.start()
+
+    sys.stderr.write("Generating and rating in the framed mode.")
+
+    while True:
+        request = channel.read()
+        if request is None:
+            break
+        # The deadlines include the time the request spends queued
+        request["received_at"] = timer()
+
+        # Invalid requests are answered right away, without failing the batch they would end up in.
+        try:
+            validate_request(request)
+        except ValueError as e:
+            channel.write({"id": request["id"], "error": str(e)})
+            continue
+
+        pool.submit(request)
+
+    pool.close()
+    exit(0)
+
+sys.stderr.write("Generating and rating. Type starting phrases to generate messages.")
+
+while True:
+    phrase = input()
+
+    # If the phrase contains a `PARAMS::` string, remove it and treat the following as a params object,
+    # same as in generate.py. Params objects can also contain the number of candidates.
+    # The best message is printed, followed by its rating and the time taken.
+    # An invalid params object is answered with an `ERROR::` line followed by a zero rating and time.
+    try:
+        if "PARAMS::" in phrase:
+            phrase, params = phrase.split("PARAMS::")
+            params = json.loads(params)
+            if not isinstance(params, dict):
+                raise ValueError("The params must be an object")
+        else:
+            params = {}
+        params["phrase"] = phrase
+        validate_request(params)
+    except ValueError as e:
+        sys.stderr.write(f"Failed to handle a request: {e}\n")
+        print("ERROR::" + " ".join(str(e).split()))
+        print(0.0)
+        print("0 s")
+        print("")
+        continue
+
+    start_time = timer()
+    [(text, rating)] = generate_best([params])
+
+    print(text)
+    print(rating)
+    print(f"{timer() - start_time} s")
+    print("")
@@ -0,0 +1,51 @@
+import sys
+import threading
+
+class ModelReloader:
+    """
+    Loads a replacement model in a background thread while the current one keeps serving, then swaps it in.
+    The requests that are already being handled finish on the old model.
+    Only one reload can be in progress at a time.
+    """
+    def __init__(self, load, validate, swap):
+        """
+        :param load: a function accepting a reload request and returning a warmed up model. It's invoked from the background thread.
+        :param validate: a function accepting the new model and raising a ValueError if it can't replace the current one.
+        :param swap: a function installing the new model in place of the current one.
+        """
+        self.load = load
+        self.validate = validate
+        self.swap = swap
+
+        self.lock = threading.Lock()
+        self.reloading = False
+
+    def reload(self, request: dict, on_done):
+        """
+        Starts reloading the model in the background.
+        :param on_done: a function accepting an error message, or none if the new model has been swapped in.
+            It's invoked from the background thread, or right away if another reload is in progress.
+        """
+        with self.lock:
+            if self.reloading:
+                on_done("Another reload is in progress")
+                return
+            self.reloading = True
+
+        threading.Thread(target=self.run, args=(request, on_done), name="model-reloader", daemon=True).start()
+
+    def run(self, request: dict, on_done):
+        try:
+            model = self.load(request)
+            self.validate(model)
+            self.swap(model)
+            error = None
+        except Exception as e:
+            # Whatever went wrong, the current model stays in place.
+            error = f"{type(e).__name__}: {e}"
+            sys.stderr.write(f"Reload failed: {error}\n")
+        finally:
+            with self.lock:
+                self.reloading = False
+
+        on_done(error)
@@ -0,0 +1,192 @@
+import contextlib
+import os
+import signal
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class Metrics:
+    """
+    Opt-in instrumentation of the hot paths: phase timings, counters and gauges, rendered in the Prometheus text format.
+    While disabled, every method returns immediately, so the instrumentation can stay in the hot paths.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.prefix = ""
+        self.lock = threading.Lock()
+
+        # phase -> [count, total seconds, max seconds]
+        self.phases = {}
+        # (name, labels) -> value
+        self.counters = {}
+        self.gauges = {}
+        # functions returning dicts of gauge values, evaluated on every render
+        self.collectors = []
+
+    def enable(self, prefix: str):
+        self.enabled = True
+        self.prefix = prefix
+
+    def time(self, phase: str):
+        """
+        Returns a context manager measuring the time spent in a phase.
+        """
+        if not self.enabled:
+            return contextlib.nullcontext()
+
+        return self.PhaseTimer(self, phase)
+
+    def observe(self, phase: str, seconds: float):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            stats = self.phases.setdefault(phase, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+
+    def increment(self, name: str, amount: float = 1, **labels):
+        if not self.enabled:
+            return
+
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def count_trace(self, function: str):
+        """
+        Must be called from the body of a tf.function: python code in it only runs while the function is being traced,
+        so this counts the (re)tracing events.
+        """
+        self.increment("tf_function_traces", function=function)
+
+    def set_gauge(self, name: str, value: float, **labels):
+        if not self.enabled:
+            return
+
+        with self.lock:
+            self.gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def add_collector(self, collector):
+        """
+        :param collector: a function returning a dict of gauge names and values.
+        """
+        self.collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self.collectors:
+            for name, value in collector().items():
+                self.set_gauge(name, value)
+
+        lines = []
+        with self.lock:
+            if len(self.phases) > 0:
+                lines.append(f"# TYPE {self.prefix}_phase_seconds summary")
+            for phase, (count, total, maximum) in sorted(self.phases.items()):
+                lines.append(f'{self.prefix}_phase_seconds_count{{phase="{phase}"}} {count}')
+                lines.append(f'{self.prefix}_phase_seconds_sum{{phase="{phase}"}} {total}')
+                lines.append(f'{self.prefix}_phase_seconds_max{{phase="{phase}"}} {maximum}')
+
+            for (name, labels), value in sorted(self.counters.items()):
+                lines.append(f"{self.prefix}_{name}_total{self.format_labels(labels)} {value}")
+            for (name, labels), value in sorted(self.gauges.items()):
+                lines.append(f"{self.prefix}_{name}{self.format_labels(labels)} {value}")
+
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def format_labels(labels: tuple) -> str:
+        if len(labels) == 0:
+            return ""
+        return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+    def export_to_file(self, filepath: str, interval: float):
+        """
+        Starts a thread periodically rewriting the file with the current metrics. The file is replaced atomically.
+        """
+        def run():
+            while True:
+                time.sleep(interval)
+
+                with open(filepath + ".tmp", "w") as file:
+                    file.write(self.render())
+                os.replace(filepath + ".tmp", filepath)
+
+        threading.Thread(target=run, name="metrics-exporter", daemon=True).start()
+
+    def serve(self, port: int):
+        """
+        Starts serving the metrics over http on localhost.
+        """
+        metrics = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = metrics.render().encode('UTF-8')
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+
+    class PhaseTimer:
+        def __init__(self, metrics, phase: str):
+            self.metrics = metrics
+            self.phase = phase
+
+        def __enter__(self):
+            self.start = time.perf_counter()
+
+        def __exit__(self, *args):
+            self.metrics.observe(self.phase, time.perf_counter() - self.start)
+
+def install_profiler_hook(logdir: str):
+    """
+    Lets the tensorflow profiler be toggled by sending SIGUSR1 to the process.
+    The collected profiles are written into logdir and can be viewed in tensorboard.
+    """
+    import tensorflow as tf
+
+    profiling = False
+
+    def toggle(signum, frame):
+        nonlocal profiling
+
+        if not profiling:
+            tf.profiler.experimental.start(logdir)
+            sys.stderr.write(f"Profiling into {logdir}\n")
+        else:
+            tf.profiler.experimental.stop()
+            sys.stderr.write("Profiling stopped\n")
+        profiling = not profiling
+
+    signal.signal(signal.SIGUSR1, toggle)
+
+def configure_from_environment(prefix: str):
+    """
+    Enables the metrics and the profiler hook according to the METRICS_FILE, METRICS_PORT, METRICS_INTERVAL
+    and PROFILE_DIR environment variables.
+    """
+    if "METRICS_FILE" in os.environ or "METRICS_PORT" in os.environ:
+        metrics.enable(prefix)
+
+        if "METRICS_FILE" in os.environ:
+            interval = float(os.environ["METRICS_INTERVAL"]) if "METRICS_INTERVAL" in os.environ else 10.0
+            metrics.export_to_file(os.environ["METRICS_FILE"], interval)
+        if "METRICS_PORT" in os.environ:
+            metrics.serve(int(os.environ["METRICS_PORT"]))
+
+    if "PROFILE_DIR" in os.environ:
+        install_profiler_hook(os.environ["PROFILE_DIR"])
+
+# The instance shared by the whole process
+metrics = Metrics()
@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+class PrefixStateCache:
+    """
+    An LRU cache of the LSTM states reached after feeding a prompt prefix, keyed by the checkpoint and the prefix.
+    The size of the cache is bounded by the total memory taken by the cached states.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size_bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, model_id: str, prefix: str) -> tuple | None:
+        """
+        :return: A tuple of the [units] arrays (state_h1, state_c1, state_h2, state_c2), or none.
+        """
+        with self.lock:
+            states = self.entries.get((model_id, prefix))
+
+            if states is not None:
+                self.entries.move_to_end((model_id, prefix))
+                self.hits += 1
+            else:
+                self.misses += 1
+
+            return states
+
+    def put(self, model_id: str, prefix: str, states: tuple):
+        size = sum(state.nbytes for state in states)
+
+        with self.lock:
+            if (model_id, prefix) in self.entries:
+                return
+
+            self.entries[(model_id, prefix)] = states
+            self.size_bytes += size
+
+            while self.size_bytes > self.max_bytes and len(self.entries) > 0:
+                _, evicted = self.entries.popitem(last=False)
+                self.size_bytes -= sum(state.nbytes for state in evicted)
+
+    @staticmethod
+    def zero_states(units_1: int, units_2: int) -> tuple:
+        return (
+            np.zeros(units_1, dtype=np.float32), np.zeros(units_1, dtype=np.float32),
+            np.zeros(units_2, dtype=np.float32), np.zeros(units_2, dtype=np.float32)
+        )
@@ -0,0 +1,165 @@
+import contextlib
+import json
+import sys
+import threading
+import time
+from collections import deque
+
+from sampling import SamplingParams
+from stopping import LengthBudget
+
+class PregenerationPool:
+    """
+    A bounded pool of messages generated in advance, while the service is idle, so that requests can be answered at once.
+    Messages are pooled per params object, i.e. per starting phrase and sampling parameters.
+    The producer thread only runs once no request has been handled for a while, and abandons the message it's
+    generating as soon as a request arrives.
+    """
+    def __init__(self, get_generator, entries: list[dict], capacity: int, default_temperature: float, idle_delay: float = 0.5, report_interval: int = 100):
+        """
+        :param get_generator: a function returning the current TextGenerator.
+        :param entries: the params objects (see generate.py) to pool messages for, each containing a "phrase".
+        :param capacity: the maximum number of messages pooled per params object.
+        :param idle_delay: the time in seconds that must pass after a request before the producer resumes.
+        :param report_interval: the statistics are written to stderr once per this many lookups.
+        """
+        self.get_generator = get_generator
+        self.entries = {self.key(entry): entry for entry in entries}
+        self.capacity = capacity
+        self.default_temperature = default_temperature
+        self.idle_delay = idle_delay
+        self.report_interval = report_interval
+
+        self.messages = {key: deque() for key in self.entries}
+        self.lock = threading.Condition()
+        self.live_requests = 0
+        self.last_request_time = 0.0
+        # Incremented whenever the pool is cleared, so that messages started before that are dropped.
+        self.generation = 0
+
+        self.hits = 0
+        self.misses = 0
+
+        self.thread = threading.Thread(target=self.run, name="pregeneration", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    @staticmethod
+    def key(params: dict) -> str:
+        """
+        Returns the key of a params object. The request id, the streaming flag and the arrival time
+        don't affect the messages.
+        """
+        return json.dumps(
+            {name: value for name, value in params.items() if name not in ("id", "stream", "received_at")},
+            sort_keys=True
+        )
+
+    def take(self, params: dict) -> str | None:
+        """
+        Takes a pooled message generated with the given params object.
+        :return: The message without the starting phrase, or none if there's none.
+        """
+        key = self.key(params)
+
+        with self.lock:
+            messages = self.messages.get(key)
+            # The params that aren't pooled don't count as misses
+            if messages is None:
+                return None
+
+            message = messages.popleft() if len(messages) > 0 else None
+            if message is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+            if (self.hits + self.misses) % self.report_interval == 0:
+                stats = self.stats()
+                sys.stderr.write(f"Pregeneration pool: hit rate {stats['hit_rate']:.3f}, fill level {stats['fill_level']:.3f}\n")
+
+        return message
+
+    @contextlib.contextmanager
+    def live_request(self):
+        """
+        Must wrap the handling of every request: the producer gives way to it.
+        """
+        with self.lock:
+            self.live_requests += 1
+
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.live_requests -= 1
+                self.last_request_time = time.time()
+                self.lock.notify_all()
+
+    def clear(self):
+        """
+        Drops the pooled messages, e.g. after the model has been replaced.
+        """
+        with self.lock:
+            for messages in self.messages.values():
+                messages.clear()
+            self.generation += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        pooled = sum(len(messages) for messages in self.messages.values())
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "size": pooled,
+            "fill_level": pooled / (self.capacity * len(self.messages)) if len(self.messages) > 0 else 0.0
+        }
+
+    def run(self):
+        while True:
+            with self.lock:
+                while True:
+                    idle = self.live_requests == 0 and time.time() - self.last_request_time >= self.idle_delay
+                    # The emptiest pool is refilled first
+                    key = min(self.messages, key=lambda key: len(self.messages[key]), default=None)
+
+                    if idle and key is not None and len(self.messages[key]) < self.capacity:
+                        break
+                    self.lock.wait(self.idle_delay)
+
+                generation = self.generation
+
+            message = self.produce(self.entries[key])
+            if message is None:
+                continue
+
+            with self.lock:
+                if self.generation == generation and len(self.messages[key]) < self.capacity:
+                    self.messages[key].append(message)
+
+    def produce(self, params: dict) -> str | None:
+        """
+        Generates a message character by character, giving up as soon as a request arrives.
+        The message is trimmed the same way as those generated on request.
+        :return: The message, or none if it has been abandoned.
+        """
+        generator = self.get_generator()
+        message = ""
+        stop_reasons = []
+
+        for chunk in generator.generate_message_stream(
+            params["phrase"],
+            params.get("ranges"),
+            SamplingParams.from_dict(params, self.default_temperature),
+            1,
+            LengthBudget.from_dict(params),
+            stop_reasons.append
+        ):
+            if self.live_requests > 0:
+                return None
+            message += chunk
+
+        return generator.trim_stopped_message(message, stop_reasons[0])
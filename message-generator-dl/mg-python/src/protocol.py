@@ -0,0 +1,69 @@
+import json
+import struct
+import sys
+import threading
+
+from metrics import metrics
+
+# Each frame is a 4-byte big-endian length followed by that many bytes of a UTF-8 encoded JSON object.
+FRAME_HEADER = struct.Struct(">I")
+
+class FramedChannel:
+    """
+    A bidirectional channel exchanging length-prefixed JSON frames over a pair of binary streams.
+    Every request carries an "id" field, which is copied into the responses, so that many requests can be
+    in flight at once and responses can be sent out of order.
+    Writing is thread-safe; reading must be done from a single thread.
+    """
+    def __init__(self, input_stream=None, output_stream=None):
+        self.input_stream = input_stream if input_stream is not None else sys.stdin.buffer
+        self.output_stream = output_stream if output_stream is not None else sys.stdout.buffer
+        self.write_lock = threading.Lock()
+
+    def read(self) -> dict | None:
+        """
+        Blocks until a frame is received.
+        Frames that aren't JSON objects with an "id" can't be answered, so they're reported to stderr and skipped.
+        :return: The decoded frame, or none if the input stream has been closed.
+        """
+        while True:
+            header = self.read_exactly(FRAME_HEADER.size)
+            if header is None:
+                return None
+
+            (length,) = FRAME_HEADER.unpack(header)
+            payload = self.read_exactly(length)
+            if payload is None:
+                return None
+
+            try:
+                with metrics.time("parse"):
+                    message = json.loads(payload.decode('UTF-8'))
+            except ValueError as e:
+                sys.stderr.write(f"Skipped a malformed frame: {e}\n")
+                continue
+
+            if not isinstance(message, dict) or "id" not in message:
+                sys.stderr.write("Skipped a frame without an id\n")
+                continue
+
+            return message
+
+    def write(self, message: dict):
+        with metrics.time("write"):
+            payload = json.dumps(message).encode('UTF-8')
+
+            with self.write_lock:
+                self.output_stream.write(FRAME_HEADER.pack(len(payload)))
+                self.output_stream.write(payload)
+                self.output_stream.flush()
+
+    def read_exactly(self, size: int) -> bytes | None:
+        data = b""
+        while len(data) < size:
+            chunk = self.input_stream.read(size - len(data))
+            if not chunk:
+                return None
+            data += chunk
+
+        return data
@@ -0,0 +1,24 @@
+import importlib
+import os
+import sys
+
+def import_rating_module(source_dir: str, name: str):
+    """
+    Imports a module of the rating subproject into this process.
+    Several modules of both subprojects share names (common.py among others), so the rating modules are imported
+    with their directory taking precedence and then removed from sys.modules: the modules of this subproject
+    are left as they were, while the imported ones keep referencing their own dependencies.
+    :param source_dir: the directory containing the python files of the rating subproject.
+    """
+    names = [os.path.splitext(file)[0] for file in os.listdir(source_dir) if file.endswith(".py")]
+    shadowed = {name: sys.modules.pop(name) for name in names if name in sys.modules}
+
+    sys.path.insert(0, source_dir)
+    try:
+        return importlib.import_module(name)
+    finally:
+        sys.path.remove(source_dir)
+
+        for module_name in names:
+            sys.modules.pop(module_name, None)
+        sys.modules.update(shadowed)
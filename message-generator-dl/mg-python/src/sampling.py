@@ -0,0 +1,89 @@
+import tensorflow as tf
+
+class SamplingParams:
+    """
+    Per-message parameters of the sampling stage.
+    """
+    def __init__(self, temperature: float = 1.0, top_k: int = 0, top_p: float = 1.0, repetition_penalty: float = 1.0):
+        """
+        :param temperature: the logits are divided by this value before sampling.
+        :param top_k: if positive, only the k most likely characters can be sampled.
+        :param top_p: only the most likely characters whose cumulative probability doesn't exceed this value can be sampled
+            (the most likely character is always kept).
+        :param repetition_penalty: the logits of the characters that have already been generated are pushed towards
+            lower probabilities by this factor. 1 disables the penalty.
+        """
+        self.temperature = temperature
+        self.top_k = top_k
+        self.top_p = top_p
+        self.repetition_penalty = repetition_penalty
+
+    @staticmethod
+    def from_dict(params: dict, default_temperature: float):
+        """
+        Reads the sampling parameters from a params object, using the defaults for the missing ones.
+        :raises ValueError: if the temperature isn't positive or top_p isn't in (0, 1].
+        """
+        sampling_params = SamplingParams(
+            params.get("temperature", default_temperature),
+            params.get("top_k", 0),
+            params.get("top_p", 1.0),
+            params.get("repetition_penalty", 1.0)
+        )
+
+        # A zero temperature would divide the logits by zero, and a zero top_p would remove every character.
+        if not sampling_params.temperature > 0:
+            raise ValueError(f"The temperature must be positive, got {sampling_params.temperature}")
+        if not 0 < sampling_params.top_p <= 1:
+            raise ValueError(f"top_p must be in (0, 1], got {sampling_params.top_p}")
+
+        return sampling_params
+
+def batch_sampling_params(params: list[SamplingParams]) -> dict:
+    """
+    Converts a list of sampling parameters, one per message, into a dict of tensors accepted by sample.
+    """
+    return {
+        "temperature": tf.constant([p.temperature for p in params], dtype=tf.float32),
+        "top_k": tf.constant([p.top_k for p in params], dtype=tf.int32),
+        "top_p": tf.constant([p.top_p for p in params], dtype=tf.float32),
+        "repetition_penalty": tf.constant([p.repetition_penalty for p in params], dtype=tf.float32)
+    }
+
+def sample(logits, sampling: dict, seen):
+    """
+    Samples token IDs from a [batch, vocab] tensor of logits.
+    The top-k and top-p filtering is performed on the k largest logits only, where k is the largest top-k of the batch,
+    so that the softmax and sampling run over k entries rather than the whole vocabulary.
+    :param sampling: a dict of tensors created by batch_sampling_params.
+    :param seen: a [batch, vocab] tensor, positive at the characters that have already been generated.
+    :return: A [batch] tensor of the sampled token IDs.
+    """
+    vocab_size = tf.shape(logits)[-1]
+
+    # Repetition penalty: positive logits are divided by it, negative ones are multiplied.
+    penalty = sampling["repetition_penalty"][:, None]
+    penalized = tf.where(logits > 0, logits / penalty, logits * penalty)
+    logits = tf.where(seen > 0, penalized, logits)
+
+    logits = logits / sampling["temperature"][:, None]
+
+    # A non-positive top-k means no top-k filtering for that message.
+    top_k = tf.where(sampling["top_k"] > 0, tf.minimum(sampling["top_k"], vocab_size), vocab_size)
+    top_logits, top_indices = tf.math.top_k(logits, k=tf.reduce_max(top_k))
+
+    # The logits are sorted, so the top-k filter of each message is a cutoff position.
+    positions = tf.range(tf.shape(top_logits)[-1])[None, :]
+    removed = positions >= top_k[:, None]
+
+    # Top-p: remove the characters after the cumulative probability of the preceding ones reaches p.
+    probabilities = tf.nn.softmax(tf.where(removed, -float('inf'), top_logits))
+    preceding_probability = tf.cumsum(probabilities, axis=-1, exclusive=True)
+    removed = tf.logical_or(removed, preceding_probability >= sampling["top_p"][:, None])
+
+    top_logits = tf.where(removed, -float('inf'), top_logits)
+
+    sampled = tf.random.categorical(top_logits, num_samples=1)
+    predicted_ids = tf.gather(top_indices, sampled, batch_dims=1)
+
+    return tf.cast(tf.squeeze(predicted_ids, axis=-1), tf.int64)
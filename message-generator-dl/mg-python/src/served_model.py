@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import types
+
+import numpy as np
+import tensorflow as tf
+
+from text_generator_model import TextGeneratorModel
+from common import *
+
+STATE_SPEC = tf.TensorSpec([None, None], tf.float32)
+
+class ExportedGeneratorModel(tf.Module):
+    """
+    A ready-to-serve artifact of a TextGeneratorModel, written by export.py.
+    Contains the carried-state call of the model with a fixed input signature, the vocabulary and the state sizes.
+    """
+    def __init__(self, model: TextGeneratorModel, vocabulary: list[str]):
+        super().__init__()
+
+        self.model = model
+        self.vocabulary = tf.Variable(vocabulary, dtype=tf.string, trainable=False)
+        self.units = tf.Variable([model.rnn1.units, model.rnn2.units], trainable=False)
+
+    @tf.function(input_signature=[tf.TensorSpec([None, None], tf.int64), STATE_SPEC, STATE_SPEC, STATE_SPEC, STATE_SPEC])
+    def call(self, input_ids, state_h1, state_c1, state_h2, state_c2):
+        logits, ([state_h1, state_c1], [state_h2, state_c2]) = self.model(
+            input_ids,
+            ([state_h1, state_c1], [state_h2, state_c2]),
+            True,
+            False
+        )
+
+        return logits, state_h1, state_c1, state_h2, state_c2
+
+class ServedGeneratorModel:
+    """
+    Serves an artifact written by export.py in place of a TextGeneratorModel.
+    Only supports the carried-state call used by TextGenerator, but doesn't need to build the model or trace it.
+    """
+    def __init__(self, path: str):
+        self.exported = tf.saved_model.load(path)
+        self.vocabulary: list[str] = [char.decode('UTF-8') for char in self.exported.vocabulary.numpy()]
+
+        # Only the unit counts of the layers are needed by create_initial_state.
+        units = self.exported.units.numpy()
+        self.rnn1 = types.SimpleNamespace(units=int(units[0]))
+        self.rnn2 = types.SimpleNamespace(units=int(units[1]))
+
+    create_initial_state = TextGeneratorModel.create_initial_state
+
+    def __call__(self, inputs, states: tuple, return_states=False, training=False):
+        (state_h1, state_c1), (state_h2, state_c2) = states
+
+        logits, state_h1, state_c1, state_h2, state_c2 = self.exported.call(inputs, state_h1, state_c1, state_h2, state_c2)
+
+        if return_states:
+            return logits, ([state_h1, state_c1], [state_h2, state_c2])
+        else:
+            return logits
+
+class TFLiteGeneratorModel:
+    """
+    Serves a reduced-precision TFLite variant of the model, written by export.py when QUANTIZE is set,
+    in place of a TextGeneratorModel. Like ServedGeneratorModel, only supports the carried-state call.
+    """
+    def __init__(self, path: str):
+        """
+        :param path: path of the .tflite file. The vocabulary and state sizes are read from the .json file next to it.
+        """
+        with open(path + ".json", "r") as file:
+            config = json.load(file)
+
+        self.vocabulary: list[str] = config["vocabulary"]
+        self.rnn1 = types.SimpleNamespace(units=config["units"][0])
+        self.rnn2 = types.SimpleNamespace(units=config["units"][1])
+
+        self.interpreter = tf.lite.Interpreter(model_path=path)
+        self.runner = self.interpreter.get_signature_runner()
+        # The interpreter isn't thread-safe.
+        self.lock = threading.Lock()
+
+    create_initial_state = TextGeneratorModel.create_initial_state
+
+    def run(self, input_ids, state_h1, state_c1, state_h2, state_c2):
+        with self.lock:
+            outputs = self.runner(
+                input_ids=input_ids.astype(np.int64),
+                state_h1=state_h1,
+                state_c1=state_c1,
+                state_h2=state_h2,
+                state_c2=state_c2
+            )
+
+        return tuple(outputs[f"output_{i}"] for i in range(5))
+
+    def __call__(self, inputs, states: tuple, return_states=False, training=False):
+        (state_h1, state_c1), (state_h2, state_c2) = states
+
+        # The interpreter runs outside of the graph, which lets TextGenerator use this model from its tf.functions.
+        logits, state_h1, state_c1, state_h2, state_c2 = tf.numpy_function(
+            self.run,
+            [inputs, state_h1, state_c1, state_h2, state_c2],
+            [tf.float32] * 5
+        )
+        logits.set_shape([None, None, len(self.vocabulary)])
+        for state in (state_h1, state_c1):
+            state.set_shape([None, self.rnn1.units])
+        for state in (state_h2, state_c2):
+            state.set_shape([None, self.rnn2.units])
+
+        if return_states:
+            return logits, ([state_h1, state_c1], [state_h2, state_c2])
+        else:
+            return logits
+
+def convert_to_tflite(exported: ExportedGeneratorModel, quantization: str) -> bytes:
+    """
+    Converts the carried-state call of an exported model to TFLite.
+    :param quantization: "float16" stores the weights in half precision,
+        "int8" quantizes the weights to 8-bit integers (dynamic range quantization).
+    """
+    converter = tf.lite.TFLiteConverter.from_concrete_functions([exported.call.get_concrete_function()], exported)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    if quantization == "float16":
+        converter.target_spec.supported_types = [tf.float16]
+    elif quantization != "int8":
+        raise Exception(f"Unknown quantization: {quantization}")
+
+    # The LSTM layers may need ops that don't have builtin TFLite kernels.
+    converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS, tf.lite.OpsSet.SELECT_TF_OPS]
+
+    return converter.convert()
+
+def load_generator_model(source: dict) -> tuple:
+    """
+    Loads a generator model along with its vocabulary.
+    :param source: a dict containing one of the "tflite_model", "saved_model" and "checkpoint" paths,
+        in this order of precedence.
+    :return: A tuple of the model and the vocabulary.
+    """
+    if source.get("tflite_model"):
+        model = TFLiteGeneratorModel(source["tflite_model"])
+        return model, model.vocabulary
+    elif source.get("saved_model"):
+        # The artifact contains the vocabulary and the model
+        model = ServedGeneratorModel(source["saved_model"])
+        return model, model.vocabulary
+
+    checkpoint = source["checkpoint"]
+
+    # Load the vocabulary
+    with open(os.path.join(checkpoint, "vocab.json"), "r") as file:
+        vocabulary = json.load(file)
+
+    model = TextGeneratorModel(
+        vocab_size=len(vocabulary),
+        batch_size=BATCH_SIZE,
+        embedding_dim=EMBEDDING_UNITS,
+        rnn_units=RNN_UNITS
+    )
+    # Load the model
+    model.load_weights(os.path.join(checkpoint, "ckpt"))
+
+    return model, vocabulary
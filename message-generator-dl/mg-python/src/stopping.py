@@ -0,0 +1,99 @@
+import math
+
+import numpy as np
+import tensorflow as tf
+
+from common import *
+
+# The number of the last generated characters inspected when looking for runaway patterns.
+RUNAWAY_WINDOW = 48
+# Repetitions of up to this many characters are considered loops.
+RUNAWAY_MAX_PERIOD = 12
+# A window whose character distribution has less entropy than this, in bits, is considered a runaway.
+RUNAWAY_MIN_ENTROPY = 1.0
+# The number of characters of a runaway window kept in the message.
+RUNAWAY_KEEP = 8
+# The python decoding loop only looks for runaways every this many characters.
+RUNAWAY_CHECK_INTERVAL = 8
+
+class LengthBudget:
+    """
+    Per-message limits of the generation.
+    """
+    def __init__(self, max_length: int = MAX_MESSAGE_LENGTH, deadline_ms: float = None, stop_on_runaway: bool = True, received_at: float = None):
+        """
+        :param max_length: the generation is cut off after this many characters.
+        :param deadline_ms: if not none, the generation is cut off once this many milliseconds have passed since
+            the start of the request, and the partial message is returned.
+        :param stop_on_runaway: whether to stop the generation once the message starts repeating itself
+            or degenerates into a few characters.
+        :param received_at: the time.time() at which the request has been received, so that the time it has spent
+            queued counts towards the deadline. If none, the deadline is counted from the start of the generation.
+        """
+        self.max_length = max_length
+        self.deadline_ms = deadline_ms
+        self.stop_on_runaway = stop_on_runaway
+        self.received_at = received_at
+
+    @staticmethod
+    def from_dict(params: dict):
+        """
+        Reads the budget from a params object, using the defaults for the missing fields.
+        """
+        return LengthBudget(
+            max(1, min(params.get("max_length", MAX_MESSAGE_LENGTH), MAX_MESSAGE_LENGTH)),
+            params.get("deadline_ms"),
+            params.get("stop_on_runaway", True),
+            params.get("received_at")
+        )
+
+def batch_budgets(budgets: list[LengthBudget], start_time: float) -> dict:
+    """
+    Converts a list of budgets, one per message, into a dict of arrays.
+    :param start_time: the time.time() at which the generation has started. The deadlines of the budgets
+        that don't know when their request has been received are counted from it.
+    """
+    return {
+        "max_length": np.array([b.max_length for b in budgets], dtype=np.int32),
+        "deadline": np.array([
+            (b.received_at if b.received_at is not None else start_time) + b.deadline_ms / 1000
+            if b.deadline_ms is not None else math.inf
+            for b in budgets
+        ], dtype=np.float64),
+        "stop_on_runaway": np.array([b.stop_on_runaway for b in budgets], dtype=bool)
+    }
+
+@tf.function(input_signature=[
+    tf.TensorSpec([None, RUNAWAY_WINDOW], tf.int64),
+    tf.TensorSpec([], tf.int32)
+])
+def detect_runaway(window, vocab_size):
+    """
+    Detects the messages whose last characters form a loop or a low-entropy pattern.
+    :param window: a [batch, RUNAWAY_WINDOW] tensor of the last generated token IDs. Mask tokens mean there were
+        fewer characters than that, in which case nothing is detected.
+    :return: A [batch] boolean tensor.
+    """
+    filled = tf.reduce_all(window != 0, axis=1)
+
+    # A loop of period p means each character equals the one p characters earlier.
+    looping = tf.zeros_like(filled)
+    for period in range(1, RUNAWAY_MAX_PERIOD + 1):
+        looping = tf.logical_or(looping, tf.reduce_all(window[:, period:] == window[:, :-period], axis=1))
+
+    counts = tf.reduce_sum(tf.one_hot(window, vocab_size), axis=1)
+    probabilities = counts / RUNAWAY_WINDOW
+    entropy = -tf.reduce_sum(tf.math.multiply_no_nan(tf.math.log(probabilities), probabilities), axis=1) / math.log(2)
+
+    return tf.logical_and(filled, tf.logical_or(looping, entropy < RUNAWAY_MIN_ENTROPY))
+
+def trim_partial(message: str) -> str:
+    """
+    Cuts a message that has been cut off mid-generation back to its last word boundary,
+    unless that would discard more than a half of it.
+    """
+    boundary = message.rfind(" ")
+    if boundary < len(message) // 2:
+        return message
+
+    return message[:boundary]
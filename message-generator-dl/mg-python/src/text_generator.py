@@ -1,19 +1,38 @@
 import sys
 import time
+import numpy as np
 import tensorflow as tf
 
+import sampling
+import stopping
+from metrics import metrics
+from prefix_cache import PrefixStateCache
+from sampling import SamplingParams
+from stopping import LengthBudget, RUNAWAY_CHECK_INTERVAL, RUNAWAY_KEEP, RUNAWAY_WINDOW, detect_runaway, trim_partial
 from text_generator_model import TextGeneratorModel
 
 from common import *
 
+# The default ranges of the perturbation added to the cached states of non-empty prompt prefixes, see prepare_inputs.
+# Those states encode the prompt, which the default ranges of the initial state would drown out in the second layer.
+CACHED_PREFIX_STATE_RANGES = [[-0.1, 0.1], [-0.1, 0.1]]
+
 class TextGenerator(tf.keras.Model):
-    def __init__(self, model, id_to_char, char_to_id, temperature=1.0):
+    def __init__(self, model, id_to_char, char_to_id, temperature=1.0, compiled_loop=False, prefix_cache: PrefixStateCache=None, model_id: str=""):
+        """
+        :param prefix_cache: if not none, the states reached after the starting phrases are cached there.
+        :param model_id: identifies the checkpoint of the model in the prefix cache.
+        """
         super().__init__()
 
         self.temperature: float = temperature
+        # Whether to run the whole decoding loop as a single graph instead of driving it from python.
+        self.compiled_loop: bool = compiled_loop
         self.model: TextGeneratorModel = model
         self.id_to_char = id_to_char
         self.char_to_id = char_to_id
+        self.prefix_cache = prefix_cache
+        self.model_id = model_id
 
         # Create a mask to prevent oov and mask tokens from being generated.
         skip_ids = self.char_to_id([MASK_TOKEN, OOV_TOKEN, MESSAGE_START])[:, None]
@@ -24,15 +43,51 @@ class TextGenerator(tf.keras.Model):
             # Match the shape to the vocabulary
             dense_shape=[len(char_to_id.get_vocabulary())])
         self.prediction_mask = tf.sparse.to_dense(sparse_mask)
+        self.vocab_size = len(char_to_id.get_vocabulary())
 
-    @tf.function
+        self.terminator_id = int(self.char_to_id([MESSAGE_TERMINATOR])[0])
+
+    @tf.function(reduce_retracing=True)
     def generate_one_step(self, inputs, states=None):
         """
         Perform a single step in the message generation.
         """
+        metrics.count_trace("generate_one_step")
+
         # Convert strings to token IDs.
-        input_chars = tf.strings.unicode_split(inputs, 'UTF-8')
-        input_ids = self.char_to_id(input_chars).to_tensor()
+        input_ids = self.tokenize(inputs)
+
+        batch_size = tf.shape(input_ids)[0]
+        default_sampling = {
+            "temperature": tf.fill([batch_size], tf.cast(self.temperature, tf.float32)),
+            "top_k": tf.zeros([batch_size], tf.int32),
+            "top_p": tf.ones([batch_size]),
+            "repetition_penalty": tf.ones([batch_size])
+        }
+        predicted_ids, states, _ = self.generate_one_step_ids(
+            input_ids,
+            states,
+            default_sampling,
+            tf.zeros([batch_size, self.vocab_size])
+        )
+
+        # Convert from token ids to characters
+        predicted_chars = self.id_to_char(predicted_ids)
+
+        # Return the characters and model state.
+        return predicted_chars, states
+
+    # Prompts of any length and batches of any size share a single trace, see warm_up.
+    @tf.function(reduce_retracing=True)
+    def generate_one_step_ids(self, input_ids, states, sampling_params: dict, seen):
+        """
+        Perform a single step in the message generation, operating on token IDs directly.
+        :param input_ids: a [batch, length] tensor of token IDs. Usually length is 1, except for the starting phrase.
+        :param sampling_params: a dict of tensors created by sampling.batch_sampling_params.
+        :param seen: a [batch, vocab] tensor counting the occurrences of each character in the generated messages.
+        :return: A tuple of a [batch] tensor of the sampled token IDs, the model state and the updated seen tensor.
+        """
+        metrics.count_trace("generate_one_step_ids")
 
         # Run the model.
         # Predicted_logits.shape is [batch, char, next_char_logits]
@@ -44,51 +99,411 @@ class TextGenerator(tf.keras.Model):
         )
 
         # Only use the last prediction.
-        predicted_logits = predicted_logits[:, -1, :]
-        predicted_logits = predicted_logits / self.temperature
+        predicted_ids = self.sample(predicted_logits[:, -1, :], sampling_params, seen)
+        seen = seen + tf.one_hot(predicted_ids, self.vocab_size)
+
+        return predicted_ids, states, seen
+
+    def sample(self, predicted_logits, sampling_params: dict, seen):
+        """
+        Samples token IDs from a [batch, vocab] tensor of logits.
+        """
         # Apply the prediction mask: prevent "[UNK]" from being generated.
         predicted_logits = predicted_logits + self.prediction_mask
 
-        # Sample the output logits to generate token IDs.
-        predicted_ids = tf.random.categorical(predicted_logits, num_samples=1)
-        predicted_ids = tf.squeeze(predicted_ids, axis=-1)
+        return sampling.sample(predicted_logits, sampling_params, seen)
 
-        # Convert from token ids to characters
-        predicted_chars = self.id_to_char(predicted_ids)
+    def create_sampling_params(self, params: list) -> dict:
+        """
+        Creates the tensors of sampling parameters for a batch of messages.
+        :param params: a list of SamplingParams or nones, one per message. Nones mean the default temperature.
+        """
+        return sampling.batch_sampling_params([
+            p if p is not None else SamplingParams(self.temperature)
+            for p in params
+        ])
 
-        # Return the characters and model state.
-        return predicted_chars, states
+    def tokenize(self, inputs):
+        """
+        Converts a rank-1 tensor of strings into a [batch, length] tensor of token IDs, padded with the mask token.
+        """
+        input_chars = tf.strings.unicode_split(inputs, 'UTF-8')
+        return self.char_to_id(input_chars).to_tensor()
+
+    def detokenize(self, ids) -> list[str]:
+        """
+        Converts a [batch, length] tensor of token IDs into a list of strings.
+        """
+        with metrics.time("detokenization"):
+            strings = tf.strings.reduce_join(self.id_to_char(ids), axis=-1)
+            return [string.decode('UTF-8') for string in strings.numpy()]
 
-    def generate_message(self, starting_phrase: str, state_random_ranges: list[list[float]]=None) -> (str, float):
+    def warm_up(self):
+        """
+        Traces the functions used during the generation, so that the first request doesn't have to wait for it.
+        The functions reduce retracing: once called with two different batch sizes and prompt lengths,
+        they're traced for arbitrary ones, and that trace is reused by all requests.
+        """
+        for batch_size, prompt in ((1, "a"), (2, "ab")):
+            states = self.create_initial_state(batch_size)
+            input_ids = self.tokenize(tf.constant([MESSAGE_START + prompt] * batch_size, dtype=tf.string))
+            sampling_params = self.create_sampling_params([None] * batch_size)
+            seen = tf.zeros([batch_size, self.vocab_size])
+
+            predicted_ids, next_states, next_seen = self.generate_one_step_ids(input_ids, states, sampling_params, seen)
+            self.generate_one_step_ids(predicted_ids.numpy()[:, None], next_states, sampling_params, next_seen)
+
+            if self.compiled_loop:
+                budgets = self.create_budgets([LengthBudget(1)] * batch_size, time.time(), True)
+                self.decode_compiled(input_ids, states, sampling_params, budgets)
+
+        # The prefix cache feeds the prompts to the model directly
+        if self.prefix_cache is not None:
+            self.compute_prefix_states(["a"])
+            self.compute_prefix_states(["ab", "abc"])
+
+    def generate_message(self, starting_phrase: str, state_random_ranges: list[list[float]]=None, sampling_params: SamplingParams=None, budget: LengthBudget=None) -> (str, float):
         """
         Generates a message.
         :param state_random_ranges: a nested list with the shape [[1_min, 1_max], [2_min, 2_max]] containing random ranges used to init the hidden states, or none.
+        :param sampling_params: the parameters of the sampling stage, or none to use the default temperature.
+        :param budget: the length and time limits of the generation, or none to use the defaults.
         :return: A tuple of the generated message and the time in seconds it took to generate it.
         """
+        results, time_taken = self.generate_messages([starting_phrase], [state_random_ranges], [sampling_params], [budget])
+
+        return results[0], time_taken
+
+    def generate_message_stream(self, starting_phrase: str, state_random_ranges: list[list[float]]=None, sampling_params: SamplingParams=None, chunk_size: int=8, budget: LengthBudget=None, on_stop=None):
+        """
+        Generates a message, yielding it in chunks as soon as the characters are produced.
+        Since the chunks can't be taken back, messages cut off by the budget or by a runaway aren't trimmed.
+        :param state_random_ranges: see generate_message.
+        :param sampling_params: see generate_message.
+        :param chunk_size: the number of characters in each chunk, except possibly the last one.
+        :param budget: see generate_message.
+        :param on_stop: if not none, a function invoked with the reason the generation has stopped once it's done:
+            "terminator", "budget" or "runaway". See trim_stopped_message.
+        :return: A generator of string chunks. The terminator is not included and newlines are replaced with spaces.
+        """
+        budget = budget if budget is not None else LengthBudget()
+        deadline = stopping.batch_budgets([budget], time.time())["deadline"][0]
+
+        with metrics.time("tokenization"):
+            input_ids, states = self.prepare_inputs([starting_phrase], [state_random_ranges])
+            sampling_params = self.create_sampling_params([sampling_params])
+        seen = tf.zeros([1, self.vocab_size])
+        output = []
+        chunk = []
+        stop_reason = "budget"
+
+        for _ in range(budget.max_length):
+            with metrics.time("model_step"):
+                predicted_ids, states, seen = self.generate_one_step_ids(input_ids, states, sampling_params, seen)
+                predicted_id = int(predicted_ids.numpy()[0])
+
+            if predicted_id == self.terminator_id:
+                stop_reason = "terminator"
+                break
+
+            output.append(predicted_id)
+            chunk.append(predicted_id)
+            if len(chunk) >= chunk_size:
+                yield self.finalize_message(self.detokenize(np.array([chunk]))[0])
+                chunk = []
+
+            if time.time() >= deadline:
+                break
+            if budget.stop_on_runaway and len(output) >= RUNAWAY_WINDOW and len(output) % RUNAWAY_CHECK_INTERVAL == 0:
+                if detect_runaway(np.array([output[-RUNAWAY_WINDOW:]]), self.vocab_size).numpy()[0]:
+                    stop_reason = "runaway"
+                    break
+
+            input_ids = np.array([[predicted_id]])
+
+        if len(chunk) > 0:
+            yield self.finalize_message(self.detokenize(np.array([chunk]))[0])
+
+        if on_stop is not None:
+            on_stop(stop_reason)
+
+    @staticmethod
+    def trim_stopped_message(message: str, stop_reason: str) -> str:
+        """
+        Applies the trimming of generate_messages to a message collected from generate_message_stream.
+        :param stop_reason: the reason passed to on_stop of generate_message_stream.
+        """
+        if stop_reason == "runaway":
+            return message[:len(message) - RUNAWAY_WINDOW + RUNAWAY_KEEP]
+        if stop_reason == "budget":
+            return trim_partial(message)
+
+        return message
+
+    def generate_messages(self, starting_phrases: list[str], state_random_ranges: list=None, sampling_params: list=None, budgets: list=None) -> (list[str], float):
+        """
+        Generates several messages at once, decoding all of them in a single batch.
+        Each message stops on its own terminator, budget or runaway; finished messages are masked out while the rest keep going.
+        Messages cut off by their budget are trimmed to the last complete word, and runaways to the start of the pattern.
+        :param starting_phrases: a list of starting phrases, one per message.
+        :param state_random_ranges: a list of random ranges (see generate_message) or nones, one per message, or none.
+        :param sampling_params: a list of SamplingParams or nones, one per message, or none.
+        :param budgets: a list of LengthBudgets or nones, one per message, or none.
+        :return: A tuple of the list of generated messages and the time in seconds it took to generate them.
+        """
         start = time.time()
-        next_char: tf.Tensor = tf.constant([MESSAGE_START + starting_phrase], dtype=tf.string)
-        result = ""
-        length = 0
+        batch_size = len(starting_phrases)
 
-        if state_random_ranges is not None:
-            first = state_random_ranges[0] if len(state_random_ranges) > 0 else None
-            second = state_random_ranges[1] if len(state_random_ranges) > 1 else None
+        if state_random_ranges is None:
+            state_random_ranges = [None] * batch_size
+        if sampling_params is None:
+            sampling_params = [None] * batch_size
+        if budgets is None:
+            budgets = [None] * batch_size
 
-            states = self.model.create_initial_state(1, first, second)
+        with metrics.time("tokenization"):
+            input_ids, states = self.prepare_inputs(starting_phrases, state_random_ranges)
+            sampling_params = self.create_sampling_params(sampling_params)
+            budgets = self.create_budgets(budgets, start, self.compiled_loop)
+
+        if self.compiled_loop:
+            # Tokenization aside, the whole generation happens within a single call here.
+            with metrics.time("decode_compiled"):
+                results = self.decode_compiled(input_ids, states, sampling_params, budgets)
+                results = [result.decode('UTF-8') for result in results.numpy()]
         else:
-            states = self.model.create_initial_state(1)
+            results = self.decode(input_ids, states, sampling_params, budgets)
+
+        # Only the messages cut off by their budget lack a terminator.
+        results = [
+            self.finalize_message(result) if MESSAGE_TERMINATOR in result else trim_partial(self.finalize_message(result))
+            for result in results
+        ]
+        end = time.time()
+
+        return results, end - start
+
+    def decode(self, input_ids, states, sampling_params: dict, budgets: dict) -> list[str]:
+        """
+        Runs the decoding loop from python, stopping as soon as every message has been terminated.
+        :param input_ids: a [batch, length] tensor of the starting token IDs.
+        :param sampling_params: a dict of tensors created by create_sampling_params.
+        :param budgets: a dict of arrays created by create_budgets.
+        :return: A list of the raw generated strings, including the terminators. Messages cut off by their budget
+            have no terminator.
+        """
+        batch_size = input_ids.shape[0]
+        max_length = int(budgets["max_length"].max())
+
+        # Generated token IDs are accumulated here and only converted to strings once the generation is done.
+        output_ids = np.zeros((batch_size, max_length), dtype=np.int64)
+        finished = np.zeros(batch_size, dtype=bool)
+        seen = tf.zeros([batch_size, self.vocab_size])
+        length = 0
 
-        while True:
-            next_char, states = self.generate_one_step(next_char, states=states)
+        while length < max_length:
+            # The model call and the sampling stage run in the same graph, so they're measured together.
+            with metrics.time("model_step"):
+                predicted_ids, states, seen = self.generate_one_step_ids(input_ids, states, sampling_params, seen)
+                predicted_ids = predicted_ids.numpy()
 
-            string = next_char[0].numpy().decode('UTF-8')
-            result += string
-            length += len(string)
+            # Finished messages receive mask tokens: masked steps leave their states untouched.
+            predicted_ids = np.where(finished, 0, predicted_ids)
+            output_ids[:, length] = predicted_ids
+            length += 1
 
-            if MESSAGE_TERMINATOR in string or length > 1000:
+            finished |= predicted_ids == self.terminator_id
+            finished |= length >= budgets["max_length"]
+            finished |= time.time() >= budgets["deadline"]
+
+            if length >= RUNAWAY_WINDOW and length % RUNAWAY_CHECK_INTERVAL == 0:
+                window = output_ids[:, length - RUNAWAY_WINDOW:length]
+                runaway = budgets["stop_on_runaway"] & ~finished & detect_runaway(window, self.vocab_size).numpy()
+
+                # Only the beginning of the pattern is kept.
+                output_ids[runaway, length - RUNAWAY_WINDOW + RUNAWAY_KEEP] = self.terminator_id
+                finished |= runaway
+
+            if finished.all():
                 break
 
-        result = result.split(MESSAGE_TERMINATOR)[0].replace("\n", " ")
-        end = time.time()
+            input_ids = predicted_ids[:, None]
+
+        return self.detokenize(output_ids[:, :length])
+
+    # Like generate_one_step_ids, traced once for all prompt lengths and batch sizes, see warm_up.
+    @tf.function(reduce_retracing=True)
+    def decode_compiled(self, input_ids, states, sampling_params: dict, budgets: dict):
+        """
+        Runs the whole decoding loop inside a single graph.
+        The terminator, budget and runaway checks are performed in the graph, so the host is only involved once per call.
+        :param input_ids: a [batch, length] tensor of the starting token IDs.
+        :param sampling_params: a dict of tensors created by create_sampling_params.
+        :param budgets: a dict of tensors created by create_budgets.
+        :return: A rank-1 tensor of the raw generated strings, see decode.
+        """
+        metrics.count_trace("decode_compiled")
+
+        output_ids = tf.TensorArray(tf.int64, size=0, dynamic_size=True)
+        batch_size = tf.shape(input_ids)[0]
+
+        def update_finished(length, predicted_ids, window, finished, cut):
+            finished = tf.logical_or(finished, tf.equal(predicted_ids, self.terminator_id))
+            finished = tf.logical_or(finished, length >= budgets["max_length"])
+            finished = tf.logical_or(finished, tf.timestamp() >= budgets["deadline"])
+
+            runaway = tf.logical_and(budgets["stop_on_runaway"], tf.logical_not(finished))
+            runaway = tf.logical_and(runaway, detect_runaway(window, self.vocab_size))
+            cut = tf.where(runaway, length - RUNAWAY_WINDOW + RUNAWAY_KEEP, cut)
+
+            return tf.logical_or(finished, runaway), cut
+
+        # The starting phrase has a different length than the subsequent inputs, so it's processed outside the loop.
+        seen = tf.zeros([batch_size, self.vocab_size])
+        predicted_ids, states, seen = self.generate_one_step_ids(input_ids, states, sampling_params, seen)
+        output_ids = output_ids.write(0, predicted_ids)
+        window = tf.concat([tf.zeros([batch_size, RUNAWAY_WINDOW - 1], tf.int64), predicted_ids[:, None]], axis=1)
+        # The positions at which runaways are cut off, or -1.
+        cut = tf.fill([batch_size], -1)
+        finished, cut = update_finished(1, predicted_ids, window, tf.zeros([batch_size], tf.bool), cut)
+
+        def condition(step, predicted_ids, states, seen, window, finished, cut, output_ids):
+            return tf.logical_not(tf.reduce_all(finished))
+
+        def body(step, predicted_ids, states, seen, window, finished, cut, output_ids):
+            predicted_ids, states, seen = self.generate_one_step_ids(predicted_ids[:, None], states, sampling_params, seen)
+
+            # Finished messages receive mask tokens: masked steps leave their states untouched.
+            predicted_ids = tf.where(finished, tf.zeros_like(predicted_ids), predicted_ids)
+            output_ids = output_ids.write(step, predicted_ids)
+            window = tf.concat([window[:, 1:], predicted_ids[:, None]], axis=1)
+            finished, cut = update_finished(step + 1, predicted_ids, window, finished, cut)
+
+            return step + 1, predicted_ids, states, seen, window, finished, cut, output_ids
+
+        _, _, _, _, _, _, cut, output_ids = tf.while_loop(
+            condition,
+            body,
+            (tf.constant(1), predicted_ids, states, seen, window, finished, cut, output_ids)
+        )
+
+        # The array is [length, batch], but detokenization needs [batch, length].
+        output_ids = tf.transpose(output_ids.stack())
+        positions = tf.range(tf.shape(output_ids)[1])[None, :]
+        output_ids = tf.where(positions == cut[:, None], tf.cast(self.terminator_id, tf.int64), output_ids)
+
+        strings = tf.strings.reduce_join(self.id_to_char(output_ids), axis=-1)
+        return strings
+
+    def create_budgets(self, budgets: list, start_time: float, compiled: bool=False) -> dict:
+        """
+        Creates the arrays of budgets for a batch of messages.
+        :param budgets: a list of LengthBudgets or nones, one per message. Nones mean the default budget.
+        :param start_time: the time.time() at which the generation has started, see stopping.batch_budgets.
+        :param compiled: whether to convert the arrays to tensors for decode_compiled.
+        """
+        budgets = stopping.batch_budgets([b if b is not None else LengthBudget() for b in budgets], start_time)
 
-        return result, end - start
+        if compiled:
+            return {key: tf.constant(value) for key, value in budgets.items()}
+        return budgets
+
+    def prepare_inputs(self, starting_phrases: list[str], state_random_ranges: list) -> tuple:
+        """
+        Creates the first inputs and the initial states for a batch of messages.
+        :param state_random_ranges: a list of random ranges (see generate_message) or nones, one per message.
+        :return: A tuple of a [batch, length] tensor of token IDs and the states of both LSTM layers.
+        """
+        prompts = [MESSAGE_START + phrase for phrase in starting_phrases]
+
+        if self.prefix_cache is None:
+            input_ids = self.tokenize(tf.constant(prompts, dtype=tf.string))
+            return input_ids, self.create_initial_states(state_random_ranges)
+
+        # With the cache, everything but the last character of a prompt is fed to the model starting with zero states.
+        # The resulting states are cached, and the random perturbation normally used as the initial state
+        # is added to them, after which the last character is fed as usual.
+        # For empty phrases, the prefix is empty, and this is the same as without the cache. For the others,
+        # the perturbation lands on states that already encode the prompt rather than before it, so the output
+        # distribution differs; unless the ranges are given, a narrower perturbation is used to limit that.
+        prefixes = [prompt[:-1] for prompt in prompts]
+        cached = {prefix: self.prefix_cache.get(self.model_id, prefix) for prefix in set(prefixes)}
+
+        missing = [prefix for prefix, states in cached.items() if states is None]
+        for prefix, states in zip(missing, self.compute_prefix_states(missing)):
+            self.prefix_cache.put(self.model_id, prefix, states)
+            cached[prefix] = states
+
+        perturbation = self.create_initial_states([
+            CACHED_PREFIX_STATE_RANGES if ranges is None and len(prefix) > 0 else ranges
+            for prefix, ranges in zip(prefixes, state_random_ranges)
+        ])
+        prefix_states = [np.stack([cached[prefix][i] for prefix in prefixes]) for i in range(4)]
+        states = (
+            [perturbation[0][0] + prefix_states[0], perturbation[0][1] + prefix_states[1]],
+            [perturbation[1][0] + prefix_states[2], perturbation[1][1] + prefix_states[3]]
+        )
+
+        input_ids = self.tokenize(tf.constant([prompt[-1] for prompt in prompts], dtype=tf.string))
+        return input_ids, states
+
+    def compute_prefix_states(self, prefixes: list[str]) -> list[tuple]:
+        """
+        Feeds the prefixes to the model in a single batch, starting with zero states.
+        :return: A list of tuples of the [units] arrays (state_h1, state_c1, state_h2, state_c2), one per prefix.
+        """
+        units_1, units_2 = self.model.rnn1.units, self.model.rnn2.units
+        results = [PrefixStateCache.zero_states(units_1, units_2) for _ in prefixes]
+
+        # Empty prefixes leave the states at zero
+        non_empty = [i for i, prefix in enumerate(prefixes) if len(prefix) > 0]
+        if len(non_empty) == 0:
+            return results
+
+        batch_size = len(non_empty)
+        zero_states = (
+            [tf.zeros([batch_size, units_1]), tf.zeros([batch_size, units_1])],
+            [tf.zeros([batch_size, units_2]), tf.zeros([batch_size, units_2])]
+        )
+        # Shorter prefixes are padded with the mask token, which leaves their states untouched.
+        input_ids = self.tokenize(tf.constant([prefixes[i] for i in non_empty], dtype=tf.string))
+        _, ([state_h1, state_c1], [state_h2, state_c2]) = self.model(input_ids, zero_states, True, False)
+
+        states = [state.numpy() for state in (state_h1, state_c1, state_h2, state_c2)]
+        for row, i in enumerate(non_empty):
+            results[i] = tuple(state[row] for state in states)
+
+        return results
+
+    def create_initial_states(self, state_random_ranges: list) -> tuple:
+        """
+        Creates the initial hidden states for a batch of messages.
+        :param state_random_ranges: a list of random ranges (see generate_message) or nones, one per message.
+        :return: The states of both LSTM layers, batched along the first axis.
+        """
+        # Most of the time all messages share the same ranges, in which case the states can be created at once.
+        if all(ranges == state_random_ranges[0] for ranges in state_random_ranges):
+            return self.create_initial_state(len(state_random_ranges), state_random_ranges[0])
+
+        row_states = [self.create_initial_state(1, ranges) for ranges in state_random_ranges]
+
+        return tuple(
+            [tf.concat([states[layer][i] for states in row_states], axis=0) for i in range(2)]
+            for layer in range(2)
+        )
+
+    def create_initial_state(self, batch_size: int, state_random_ranges: list[list[float]]=None) -> tuple:
+        if state_random_ranges is not None:
+            first = state_random_ranges[0] if len(state_random_ranges) > 0 else None
+            second = state_random_ranges[1] if len(state_random_ranges) > 1 else None
+
+            return self.model.create_initial_state(batch_size, first, second)
+        else:
+            return self.model.create_initial_state(batch_size)
+
+    @staticmethod
+    def finalize_message(result: str) -> str:
+        """
+        Cuts off everything after the message terminator, drops the padding and collapses newlines.
+        """
+        return result.split(MESSAGE_TERMINATOR)[0].replace(MASK_TOKEN, "").replace("\n", " ")
@@ -1,6 +1,12 @@
+import hashlib
+import json
+import os
+
 import tensorflow as tf
 import numpy as np
 
+from corpus_cache import file_digest
+
 class TextGeneratorModel(tf.keras.Model):
     def __init__(self, batch_size, vocab_size, embedding_dim, rnn_units, dropout_rate=0.0):
         super().__init__(self)
@@ -32,36 +38,44 @@ class TextGeneratorModel(tf.keras.Model):
     def load_embedding_layer(self, filepath: str, vocabulary: list):
         """
         Loads some pre-trained character embedding data.
+        Only the rows of the characters present in the vocabulary are parsed. The extracted rows are cached
+        next to the file, keyed by the file contents and the vocabulary, so that subsequent loads skip parsing.
         """
-        embeddings_index = {}
+        key = hashlib.sha256((file_digest(filepath) + json.dumps(vocabulary)).encode('UTF-8')).hexdigest()
+        cache_file = f"{filepath}.{key[:16]}.npy"
+
+        if os.path.exists(cache_file):
+            # Characters missing from the file are stored as rows of nans
+            pretrained_matrix = np.load(cache_file)
+        else:
+            char_ids = {char: i for i, char in enumerate(vocabulary)}
+            indices = []
+            rows = []
 
-        with open(filepath) as file:
-            for line in file:
-                if len(line) < 100:
-                    continue
-                values = line.split()
-                char = values[0]
-                embeddings = np.asarray(values[1:], dtype='float32')
-                embeddings_index[char] = embeddings
+            with open(filepath) as file:
+                for line in file:
+                    if len(line) < 100:
+                        continue
+                    char, values = line.split(maxsplit=1)
 
-        embedding_dim = len(embeddings_index['a'])
+                    if char in char_ids:
+                        indices.append(char_ids[char])
+                        rows.append(np.array(values.split(), dtype='float32'))
 
-        if (embedding_dim != self.embedding_dim):
-            raise Exception("Embedding dim mismatch")
+            if len(rows) == 0 or len(rows[0]) != self.embedding_dim:
+                raise Exception("Embedding dim mismatch")
 
-        embedding_matrix = np.ndarray((len(vocabulary), embedding_dim))
-        original_matrix = self.embedding.embeddings.numpy()
+            pretrained_matrix = np.full((len(vocabulary), self.embedding_dim), np.nan, dtype='float32')
+            pretrained_matrix[indices] = np.stack(rows)
+            np.save(cache_file, pretrained_matrix)
 
-        i = 0
-        for char in vocabulary:
-            if (char in embeddings_index):
-                embedding_matrix[i] = embeddings_index[char]
-            else:
-                embedding_matrix[i] = original_matrix[i]
-            i += 1
+        # The characters that have no pre-trained embedding retain their initial embedding
+        found = ~np.isnan(pretrained_matrix[:, 0])
+        embedding_matrix = self.embedding.embeddings.numpy()
+        embedding_matrix[found] = pretrained_matrix[found]
 
-        self.embedding.embeddings = embedding_matrix
-        print(self.embedding.embeddings)
+        self.embedding.embeddings.assign(embedding_matrix)
+        print(f"Loaded pre-trained embeddings for {np.count_nonzero(found)} of {len(vocabulary)} characters")
 
     def create_initial_state(self, batch_size: int, range_1=None, range_2=None):
         if range_1 is None:
@@ -76,7 +90,7 @@ class TextGeneratorModel(tf.keras.Model):
 
         return ([random_h1, random_c1], [random_h2, random_c2])
 
-    @tf.function
+    @tf.function(reduce_retracing=True)
     def call(self, inputs, states: tuple=None, return_states=False, training=False):
         x = self.embedding(inputs, training = training)
 
@@ -7,16 +7,37 @@
 # PRETRAINED_EMBEDDING - file path                                                             #
 # RESTORE_STATE - if set and not an empty state, will load the previous state before training. #
 # EPOCHS - integer                                                                             #
+# DATASET - file path. If set, the dataset is read from this file instead of stdin.            #
+# CORPUS_CACHE - directory path. If set, the tokenized dataset is cached there and reused      #
+#   by subsequent runs with the same dataset and vocabulary.                                   #
+# CORPUS_CACHE_KEEP - integer, the number of compiled corpora kept in CORPUS_CACHE, including  #
+#   the current one; the least recently used ones are deleted. Defaults to 3.                  #
+#   Note that TextGenerator.train() adds random terminators to the dataset on every run, so its#
+#   runs never reuse a cached corpus and only benefit from running this script on a fixed file.#
+# WINDOW_LENGTH - integer. If set, the messages are laid out in parallel streams cut into      #
+#   windows of this length, and the states are carried from one window to the next             #
+#   (truncated backpropagation through time). See windowed_training.py.                        #
+# XLA - if set and not empty, the training steps are compiled with XLA. Mostly useful with     #
+#   WINDOW_LENGTH, since all its batches have the same shape.                                  #
+# KEEP_CHECKPOINTS - integer. If set, only this many of the latest checkpoints of this run are #
+#   kept, along with the best ones by loss. Checkpoints are written in the background either   #
+#   way.                                                                                       #
+# KEEP_BEST_CHECKPOINTS - integer, the number of the best checkpoints kept. Defaults to 1.     #
 ################################################################################################
 import datetime
 import json
 import os
+import shutil
 import sys
+import tempfile
 
 import tensorflow as tf
 
+import corpus_cache
+from checkpoint_writer import CheckpointWriter
 from common import *
 from text_generator_model import TextGeneratorModel
+from windowed_training import WindowedTrainer, windowed_batches
 
 if ('CHECKPOINT_DIR' not in os.environ or 'EPOCHS' not in os.environ):
     print("CHECKPOINT_DIR or EPOCHS environment variables are not set")
@@ -25,59 +46,124 @@ epochs = int(os.environ['EPOCHS'])
 checkpoint_dir = os.environ['CHECKPOINT_DIR']
 restore_state = bool(os.environ['RESTORE_STATE']) if 'RESTORE_STATE' in os.environ else False
 pretrained_embedding = os.environ['PRETRAINED_EMBEDDING'] if 'PRETRAINED_EMBEDDING' in os.environ else None
+corpus_cache_dir = os.environ['CORPUS_CACHE'] if 'CORPUS_CACHE' in os.environ else None
+corpus_cache_keep = int(os.environ['CORPUS_CACHE_KEEP']) if 'CORPUS_CACHE_KEEP' in os.environ else 3
+window_length = int(os.environ['WINDOW_LENGTH']) if 'WINDOW_LENGTH' in os.environ else None
+jit_compile = bool(os.environ['XLA']) if 'XLA' in os.environ else False
+keep_checkpoints = int(os.environ['KEEP_CHECKPOINTS']) if 'KEEP_CHECKPOINTS' in os.environ else None
+keep_best_checkpoints = int(os.environ['KEEP_BEST_CHECKPOINTS']) if 'KEEP_BEST_CHECKPOINTS' in os.environ else 1
+
+# The dataset is never held in memory as a whole: it's streamed from a file line by line.
+# When it comes from stdin, it's spooled to a temporary file first.
+if 'DATASET' in os.environ:
+    dataset_file = os.environ['DATASET']
+    spooled = False
+else:
+    with tempfile.NamedTemporaryFile("w", encoding="utf-8", suffix=".txt", delete=False) as file:
+        dataset_file = file.name
+        spooled = True
 
-# Read the dataset
-text = sys.stdin.read()
-# Tensor of lines of unicode characters
-lines = tf.ragged.constant(list(map(
-    lambda line: [char for char in list(line)],
-    text.splitlines()
-)))
+        shutil.copyfileobj(sys.stdin, file)
 
-if restore_state:
-    loaded_checkpoint_dir = os.environ['CHECKPOINT']
+def read_lines():
+    with open(dataset_file, "r", encoding="utf-8") as file:
+        for line in file:
+            yield line.rstrip("\n")
 
-    # Load the existing vocabulary
-    with open(os.path.join(loaded_checkpoint_dir, "vocab.json"), "r") as file:
-        vocabulary = json.load(file)
-else:
+def create_vocabulary():
     # Create a new vocabulary
     # The first characters, a-z and A-Z, come in pairs
     vocabulary = [MASK_TOKEN, OOV_TOKEN] + list("aAbBcCdDeEfFgGhHiIjJkKlLmMnNoOpPqQrRsStTuUvVwWxXyYzZ")
+
+    dataset_chars = set("\n")
+    for line in read_lines():
+        dataset_chars.update(line)
+
     # The rest of the vocabulary is sorted and inherited from the input
     vocabulary.extend(
         list(filter(
             lambda char: char not in vocabulary, # Only retain non-letters
-            sorted(set(text)) # Individual characters from the text
+            sorted(dataset_chars) # Individual characters from the text
         ))
     )
+    return vocabulary
+
+if restore_state:
+    loaded_checkpoint_dir = os.environ['CHECKPOINT']
+
+    # Load the existing vocabulary
+    with open(os.path.join(loaded_checkpoint_dir, "vocab.json"), "r") as file:
+        vocabulary = json.load(file)
+
+# The compiled corpus contains the vocabulary, so neither has to be rebuilt if the dataset hasn't changed.
+corpus = None
+if corpus_cache_dir is not None:
+    corpus_key = corpus_cache.corpus_key(corpus_cache.file_digest(dataset_file), vocabulary if restore_state else None)
+    corpus = corpus_cache.load_corpus(corpus_cache_dir, corpus_key)
+
+    if corpus is None:
+        print("Compiling the corpus...")
+        if not restore_state:
+            vocabulary = create_vocabulary()
+        corpus = corpus_cache.compile_corpus(corpus_cache_dir, corpus_key, read_lines(), vocabulary)
+    corpus_cache.evict_corpora(corpus_cache_dir, corpus_cache_keep, corpus_key)
+
+    vocabulary = corpus.vocabulary
+elif not restore_state:
+    vocabulary = create_vocabulary()
 
 char_to_id = tf.keras.layers.StringLookup(vocabulary=vocabulary, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
 id_to_char = tf.keras.layers.StringLookup(vocabulary=char_to_id.get_vocabulary(), invert=True, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
 
-all_ids = char_to_id(lines)
-
-dataset = (
-    tf.data.Dataset.from_tensor_slices(all_ids)
-        .map(lambda x: (x[:-1], x[1:]))
-        .batch(BATCH_SIZE)
-        .shuffle(1000, reshuffle_each_iteration=True)
-        .prefetch(tf.data.experimental.AUTOTUNE))
-
-model = TextGeneratorModel(
-    vocab_size=len(char_to_id.get_vocabulary()),
-    batch_size=BATCH_SIZE,
-    embedding_dim=EMBEDDING_UNITS,
-    rnn_units=RNN_UNITS,
-    dropout_rate=DROPOUT_RATE
-)
+if corpus is not None:
+    examples = tf.data.Dataset.from_generator(corpus.examples, output_signature=tf.TensorSpec([None], tf.int64))
+else:
+    examples = (
+        tf.data.TextLineDataset(dataset_file)
+            # Tokenize the lines on the fly
+            .map(lambda line: char_to_id(tf.strings.unicode_split(line, 'UTF-8')), num_parallel_calls=tf.data.experimental.AUTOTUNE))
+
+if window_length is None:
+    dataset = (
+        examples
+            .map(lambda x: (x[:-1], x[1:]))
+            .padded_batch(BATCH_SIZE)
+            .shuffle(1000, reshuffle_each_iteration=True)
+            .prefetch(tf.data.experimental.AUTOTUNE))
+else:
+    # The batches must stay in order for the states to be carried over, so the messages are shuffled instead.
+    shuffled_examples = examples.shuffle(1000, reshuffle_each_iteration=True)
+    dataset = (
+        tf.data.Dataset.from_generator(
+            lambda: windowed_batches(shuffled_examples.as_numpy_iterator(), BATCH_SIZE, window_length),
+            output_signature=(
+                (tf.TensorSpec([BATCH_SIZE, window_length], tf.int64), tf.TensorSpec([BATCH_SIZE], tf.bool)),
+                tf.TensorSpec([BATCH_SIZE, window_length], tf.int64)
+            ))
+            .prefetch(tf.data.experimental.AUTOTUNE))
+
+def create_model(dropout_rate=0.0):
+    return TextGeneratorModel(
+        vocab_size=len(char_to_id.get_vocabulary()),
+        batch_size=BATCH_SIZE,
+        embedding_dim=EMBEDDING_UNITS,
+        rnn_units=RNN_UNITS,
+        dropout_rate=dropout_rate
+    )
+
+model = create_model(DROPOUT_RATE)
 
 model.summary()
 
 # Training the model
 loss = tf.losses.SparseCategoricalCrossentropy(from_logits=True)
 optimizer = tf.optimizers.Adam(learning_rate=LEARNING_RATE)
-model.compile(optimizer=optimizer, loss=loss)
+# The weights are shared, so the checkpoints are written from the model either way.
+trainer = model if window_length is None else WindowedTrainer(model, BATCH_SIZE)
+trainer.compile(optimizer=optimizer, loss=loss, jit_compile=jit_compile)
+if trainer is not model:
+    # Makes the checkpoints of the model include the optimizer state, same as without the windows
+    model.compile(optimizer=optimizer)
 
 if (restore_state):
     # noinspection PyUnboundLocalVariable
@@ -85,6 +171,8 @@ if (restore_state):
 elif pretrained_embedding is not None:
     model.load_embedding_layer(pretrained_embedding, char_to_id.get_vocabulary())
 
+checkpoint_writer = CheckpointWriter(checkpoint_dir, char_to_id.get_vocabulary(), create_model, keep_checkpoints, keep_best_checkpoints)
+
 last_epoch = 0
 def create_checkpoint_if_necessary(epoch=-1, logs=None, force=False):
     global last_epoch
@@ -92,20 +180,17 @@ def create_checkpoint_if_necessary(epoch=-1, logs=None, force=False):
     if (((epoch + 1) % 5 == 0 or force) and epoch != last_epoch):
         timestamp = str(datetime.datetime.now()).split(".")[0].replace(":", ".")
 
-        checkpoint = os.path.join(checkpoint_dir, f"ckpt_{timestamp}")
+        name = f"ckpt_{timestamp}"
         if (logs is not None):
-            checkpoint += " loss %.3f" % logs['loss']
-        os.mkdir(checkpoint)
+            name += " loss %.3f" % logs['loss']
 
-        print(f"\nBacking the current checkpoint up to {checkpoint}")
-        model.save_weights(os.path.join(checkpoint, "ckpt"))
-
-        with open(os.path.join(checkpoint, "vocab.json"), "w") as file:
-            json.dump(char_to_id.get_vocabulary(), file)
+        print(f"\nBacking the current checkpoint up to {os.path.join(checkpoint_dir, name)}")
+        # Only the copying of the weights happens here; they're written to the disk in the background.
+        checkpoint_writer.save(name, model, logs['loss'] if logs is not None else None)
 
         last_epoch = epoch
 
-history = model.fit(
+history = trainer.fit(
     dataset,
     epochs=epochs,
     callbacks=[
@@ -116,3 +201,8 @@ history = model.fit(
         )
     ]
 )
+
+checkpoint_writer.close()
+
+if spooled:
+    os.remove(dataset_file)
@@ -0,0 +1,90 @@
+from collections import deque
+
+import numpy as np
+import tensorflow as tf
+
+from text_generator_model import TextGeneratorModel
+
+def windowed_batches(messages, batch_size: int, window_length: int):
+    """
+    Lays the messages out in batch_size parallel streams and cuts the streams into windows of a fixed length.
+    Consecutive batches continue the same streams, so that the states can be carried from one window to the next.
+    Every message starts at the beginning of a window, and the rest of the window it ends in is padded with
+    the mask token, which leaves the states untouched and is excluded from the loss.
+    :param messages: an iterable of rank-1 arrays of token IDs, each one a whole message.
+    :return: A generator of ((inputs, reset), targets) tuples, where inputs and targets are [batch_size, window_length]
+        arrays and reset is a [batch_size] array, true for the rows whose states must be reset before the window.
+    """
+    # The windows each stream is yet to yield, as (inputs, targets, reset) tuples.
+    streams = [deque() for _ in range(batch_size)]
+    empty_window = np.zeros(window_length, dtype=np.int64)
+
+    def take_batch():
+        windows = [stream.popleft() if len(stream) > 0 else (empty_window, empty_window, True) for stream in streams]
+
+        return (
+            (np.stack([window[0] for window in windows]), np.array([window[2] for window in windows])),
+            np.stack([window[1] for window in windows])
+        )
+
+    for message in messages:
+        inputs, targets = message[:-1], message[1:]
+
+        padded_length = -(-len(inputs) // window_length) * window_length
+        inputs = np.pad(inputs, (0, padded_length - len(inputs)))
+        targets = np.pad(targets, (0, padded_length - len(targets)))
+
+        # Each message goes to the stream with the fewest pending windows.
+        stream = min(streams, key=len)
+        for start in range(0, padded_length, window_length):
+            stream.append((inputs[start:start + window_length], targets[start:start + window_length], start == 0))
+
+        while all(len(stream) > 0 for stream in streams):
+            yield take_batch()
+
+    while any(len(stream) > 0 for stream in streams):
+        yield take_batch()
+
+class WindowedTrainer(tf.keras.Model):
+    """
+    Trains a TextGeneratorModel with truncated backpropagation through time over the batches of windowed_batches.
+    The states reached at the end of each window are stored and used as the initial states of the next window
+    of the same stream, unless a new message starts there, in which case they're reset to zeros.
+    The weights are those of the wrapped model, so it can be saved and loaded as usual.
+    """
+    def __init__(self, generator_model: TextGeneratorModel, batch_size: int):
+        super().__init__()
+
+        self.generator_model = generator_model
+        units_1, units_2 = generator_model.rnn1.units, generator_model.rnn2.units
+        self.states = [
+            tf.Variable(tf.zeros([batch_size, units]), trainable=False)
+            for units in (units_1, units_1, units_2, units_2)
+        ]
+        self.loss_tracker = tf.keras.metrics.Mean(name="loss")
+
+    @property
+    def metrics(self):
+        # Lets keras reset the average loss at the start of each epoch
+        return [self.loss_tracker]
+
+    def train_step(self, data):
+        (inputs, reset), targets = data
+
+        keep = 1.0 - tf.cast(reset, tf.float32)[:, None]
+        state_h1, state_c1, state_h2, state_c2 = [state * keep for state in self.states]
+
+        with tf.GradientTape() as tape:
+            logits, states = self.generator_model(inputs, ([state_h1, state_c1], [state_h2, state_c2]), True, True)
+            # The padding doesn't contribute to the loss
+            loss = self.compiled_loss(targets, logits, sample_weight=tf.cast(inputs != 0, tf.float32))
+
+        variables = self.generator_model.trainable_variables
+        self.optimizer.apply_gradients(zip(tape.gradient(loss, variables), variables))
+
+        # The gradients stop at the window boundaries
+        for variable, state in zip(self.states, states[0] + states[1]):
+            variable.assign(tf.stop_gradient(state))
+
+        self.loss_tracker.update_state(loss)
+        return {"loss": self.loss_tracker.result()}
@@ -0,0 +1,85 @@
+import queue
+import sys
+import threading
+
+class Worker:
+    """
+    A thread that handles batches of requests from its own queue.
+    """
+    def __init__(self, pool, index: int):
+        self.pool = pool
+        self.requests = queue.Queue()
+        # The number of requests submitted to this worker that haven't been handled yet.
+        self.load = 0
+        self.thread = threading.Thread(target=self.run, name=f"generator-worker-{index}", daemon=True)
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            while len(batch) < self.pool.max_batch_size and not self.requests.empty():
+                batch.append(self.requests.get())
+
+            # A none request means the pool is being closed.
+            closed = None in batch
+            batch = [request for request in batch if request is not None]
+
+            if len(batch) > 0:
+                try:
+                    self.pool.handler(batch)
+                except Exception as e:
+                    # A failed batch mustn't stop the worker, or its queued requests would never be answered.
+                    sys.stderr.write(f"Failed to handle a batch of {len(batch)} requests: {e}\n")
+                    for request in batch:
+                        self.pool.on_error(request, str(e))
+                finally:
+                    with self.pool.lock:
+                        self.load -= len(batch)
+
+            if closed:
+                break
+
+class WorkerPool:
+    """
+    Distributes requests among several worker threads sharing the same model.
+    Each request is placed on the least loaded worker; the requests queued on a worker are handled in batches.
+    """
+    def __init__(self, handler, size: int, max_batch_size: int, on_error=lambda request, error: None):
+        """
+        :param handler: a function accepting a list of requests. It's invoked from the worker threads.
+        :param on_error: a function accepting a request and an error message, invoked for each request of a batch
+            whose handler has raised an exception.
+        :param size: the number of workers.
+        :param max_batch_size: the maximum number of requests passed to the handler at once.
+        """
+        self.handler = handler
+        self.on_error = on_error
+        self.max_batch_size = max_batch_size
+        self.lock = threading.Lock()
+        self.workers = [Worker(self, i) for i in range(size)]
+
+    def start(self):
+        for worker in self.workers:
+            worker.thread.start()
+
+    def submit(self, request):
+        with self.lock:
+            worker = min(self.workers, key=lambda worker: worker.load)
+            worker.load += 1
+
+        worker.requests.put(request)
+
+    def queue_depth(self) -> int:
+        """
+        Returns the total number of requests that haven't been handled yet.
+        """
+        with self.lock:
+            return sum(worker.load for worker in self.workers)
+
+    def close(self):
+        """
+        Lets the workers finish the submitted requests and waits for them to stop.
+        """
+        for worker in self.workers:
+            worker.requests.put(None)
+        for worker in self.workers:
+            worker.thread.join()
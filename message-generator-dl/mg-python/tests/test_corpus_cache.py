@@ -0,0 +1,28 @@
+import os
+
+import corpus_cache
+
+VOCABULARY = ["\u0001", "[UNK]", "a", "b"]
+
+def test_round_trip(tmp_path):
+    corpus_cache.compile_corpus(tmp_path, "key", ["ab", "", "bax"], VOCABULARY, [1.0, 0.0, -1.0])
+    corpus = corpus_cache.load_corpus(tmp_path, "key")
+
+    examples = [(list(tokens), float(label)) for tokens, label in corpus.examples()]
+    assert examples == [([2, 3], 1.0), ([], 0.0), ([3, 2, 1], -1.0)]
+    assert corpus.vocabulary == VOCABULARY
+
+def test_missing_corpus(tmp_path):
+    assert corpus_cache.load_corpus(tmp_path, "key") is None
+
+def test_evicts_the_least_recently_used_corpora(tmp_path):
+    for i, key in enumerate(["old", "used", "new", "current"]):
+        corpus_cache.compile_corpus(tmp_path, key, ["ab"], VOCABULARY)
+        os.utime(os.path.join(tmp_path, key, "vocab.json"), (i, i))
+    # A corpus that is being compiled has no vocabulary yet
+    os.makedirs(os.path.join(tmp_path, "partial"))
+
+    corpus_cache.load_corpus(tmp_path, "used")
+    corpus_cache.evict_corpora(tmp_path, 2, "current")
+
+    assert sorted(os.listdir(tmp_path)) == ["current", "partial", "used"]
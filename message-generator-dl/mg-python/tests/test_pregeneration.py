@@ -0,0 +1,62 @@
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from pregeneration import PregenerationPool
+from text_generator import TextGenerator
+
+class FakeGenerator:
+    """
+    Streams a fixed message one character at a time.
+    """
+    def __init__(self, message: str, stop_reason: str = "terminator", on_chunk=lambda: None):
+        self.message = message
+        self.stop_reason = stop_reason
+        self.on_chunk = on_chunk
+
+    def generate_message_stream(self, starting_phrase, state_random_ranges=None, sampling_params=None, chunk_size=8, budget=None, on_stop=None):
+        for char in self.message:
+            self.on_chunk()
+            yield char
+        if on_stop is not None:
+            on_stop(self.stop_reason)
+
+    trim_stopped_message = staticmethod(TextGenerator.trim_stopped_message)
+
+def create_pool(generator: FakeGenerator, entries: list[dict] = None) -> PregenerationPool:
+    return PregenerationPool(lambda: generator, entries or [{"phrase": "hi"}], 2, 1.0)
+
+def test_key_ignores_the_id_and_streaming():
+    assert PregenerationPool.key({"phrase": "hi", "id": 1, "stream": True, "received_at": 5.0}) == PregenerationPool.key({"phrase": "hi"})
+    assert PregenerationPool.key({"phrase": "hi", "temperature": 0.5}) != PregenerationPool.key({"phrase": "hi"})
+
+def test_take_counts_only_pooled_params():
+    pool = create_pool(FakeGenerator(" there"))
+    pool.messages[pool.key({"phrase": "hi"})].append(" there")
+
+    assert pool.take({"phrase": "hi", "id": 3}) == " there"
+    assert pool.take({"phrase": "hi", "id": 4}) is None
+    assert pool.take({"phrase": "other"}) is None
+    assert (pool.stats()["hits"], pool.stats()["misses"]) == (1, 1)
+
+def test_clear_drops_the_messages():
+    pool = create_pool(FakeGenerator(" there"))
+    pool.messages[pool.key({"phrase": "hi"})].append(" there")
+
+    pool.clear()
+
+    assert pool.take({"phrase": "hi"}) is None
+    assert pool.generation == 1
+
+def test_produce_trims_like_generate_messages():
+    assert create_pool(FakeGenerator(" hello there wor", "budget")).produce({"phrase": "hi"}) == " hello there"
+    assert create_pool(FakeGenerator(" hello there wor")).produce({"phrase": "hi"}) == " hello there wor"
+
+def test_produce_gives_way_to_requests():
+    pool = None
+
+    def arrive():
+        pool.live_requests = 1
+
+    pool = create_pool(FakeGenerator(" there", on_chunk=arrive))
+    assert pool.produce({"phrase": "hi"}) is None
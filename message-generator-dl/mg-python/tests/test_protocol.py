@@ -0,0 +1,24 @@
+import io
+import json
+
+from protocol import FRAME_HEADER, FramedChannel
+
+def frame(payload: bytes) -> bytes:
+    return FRAME_HEADER.pack(len(payload)) + payload
+
+def test_round_trip():
+    output = io.BytesIO()
+    FramedChannel(io.BytesIO(), output).write({"id": 1, "text": "hello"})
+
+    assert FramedChannel(io.BytesIO(output.getvalue()), io.BytesIO()).read() == {"id": 1, "text": "hello"}
+
+def test_skips_frames_that_cant_be_answered():
+    frames = [b"{not json", b"\xff\xfe", b"[1, 2]", json.dumps({"phrase": "hi"}).encode(), json.dumps({"id": 7}).encode()]
+    channel = FramedChannel(io.BytesIO(b"".join(frame(payload) for payload in frames)), io.BytesIO())
+
+    assert channel.read() == {"id": 7}
+    assert channel.read() is None
+
+def test_returns_none_on_a_truncated_frame():
+    data = frame(json.dumps({"id": 1}).encode())
+    assert FramedChannel(io.BytesIO(data[:-2]), io.BytesIO()).read() is None
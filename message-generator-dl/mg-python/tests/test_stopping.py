@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from common import MAX_MESSAGE_LENGTH
+from stopping import LengthBudget, RUNAWAY_KEEP, RUNAWAY_WINDOW, batch_budgets, detect_runaway, trim_partial
+from text_generator import TextGenerator
+
+VOCAB_SIZE = 40
+
+def detect(windows: list[list[int]]) -> list[bool]:
+    return [bool(runaway) for runaway in detect_runaway(np.array(windows, dtype=np.int64), VOCAB_SIZE).numpy()]
+
+def looping_window(period: int) -> list[int]:
+    return [2 + i % period for i in range(RUNAWAY_WINDOW)]
+
+def varied_window() -> list[int]:
+    # Repeats only every 37 characters and uses most of the vocabulary
+    return [2 + (i * 7) % 37 for i in range(RUNAWAY_WINDOW)]
+
+@pytest.mark.parametrize("period", [1, 2, 5, 12])
+def test_detects_loops(period):
+    assert detect([looping_window(period)]) == [True]
+
+def test_ignores_longer_periods():
+    assert detect([looping_window(13)]) == [False]
+
+def test_detects_low_entropy():
+    window = [2] * RUNAWAY_WINDOW
+    for position, token in zip((5, 17, 30, 41), (3, 4, 5, 6)):
+        window[position] = token
+
+    assert detect([window]) == [True]
+
+def test_ignores_varied_text():
+    assert detect([varied_window()]) == [False]
+
+def test_ignores_windows_that_are_not_filled():
+    window = looping_window(1)
+    window[:RUNAWAY_WINDOW // 2] = [0] * (RUNAWAY_WINDOW // 2)
+
+    assert detect([window]) == [False]
+
+def test_detects_per_message():
+    assert detect([varied_window(), looping_window(3), varied_window()]) == [False, True, False]
+
+def test_trim_partial_cuts_at_the_last_word():
+    assert trim_partial("hello there wor") == "hello there"
+
+def test_trim_partial_keeps_most_of_the_message():
+    assert trim_partial("a verylongword") == "a verylongword"
+    assert trim_partial("nospaces") == "nospaces"
+
+def test_trim_stopped_message():
+    message = "abcd" * 15
+
+    assert TextGenerator.trim_stopped_message(message, "terminator") == message
+    assert TextGenerator.trim_stopped_message(message, "runaway") == message[:len(message) - RUNAWAY_WINDOW + RUNAWAY_KEEP]
+    assert TextGenerator.trim_stopped_message("hello there wor", "budget") == "hello there"
+
+def test_budget_from_dict():
+    budget = LengthBudget.from_dict({"max_length": 20, "deadline_ms": 150, "stop_on_runaway": False})
+
+    assert (budget.max_length, budget.deadline_ms, budget.stop_on_runaway) == (20, 150, False)
+
+def test_budget_from_dict_defaults_and_clamping():
+    default = LengthBudget.from_dict({})
+    assert (default.max_length, default.deadline_ms, default.stop_on_runaway) == (MAX_MESSAGE_LENGTH, None, True)
+
+    assert LengthBudget.from_dict({"max_length": 0}).max_length == 1
+    assert LengthBudget.from_dict({"max_length": MAX_MESSAGE_LENGTH * 10}).max_length == MAX_MESSAGE_LENGTH
+
+def test_deadlines_count_from_the_arrival_of_the_request():
+    budgets = batch_budgets([
+        LengthBudget(deadline_ms=500, received_at=100.0),
+        LengthBudget(deadline_ms=500),
+        LengthBudget()
+    ], 102.0)
+
+    assert list(budgets["deadline"]) == [100.5, 102.5, np.inf]
@@ -0,0 +1,71 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from windowed_training import windowed_batches
+
+BATCH_SIZE = 2
+WINDOW_LENGTH = 4
+
+def create_messages(lengths: list[int]) -> list[np.ndarray]:
+    # Distinct non-zero token IDs, so that every message can be told apart from the others and from the padding
+    return [np.arange(1, length + 1, dtype=np.int64) + 100 * i for i, length in enumerate(lengths)]
+
+def split_streams(batches: list) -> list[list[tuple]]:
+    """
+    :return: A list of the (inputs, targets, reset) windows of each stream, in order.
+    """
+    return [
+        [(inputs[row], targets[row], reset[row]) for (inputs, reset), targets in batches]
+        for row in range(BATCH_SIZE)
+    ]
+
+def test_batch_shapes():
+    for (inputs, reset), targets in windowed_batches(create_messages([3, 9, 5, 2, 12]), BATCH_SIZE, WINDOW_LENGTH):
+        assert inputs.shape == (BATCH_SIZE, WINDOW_LENGTH)
+        assert targets.shape == (BATCH_SIZE, WINDOW_LENGTH)
+        assert reset.shape == (BATCH_SIZE,)
+
+def test_streams_contain_whole_messages():
+    messages = create_messages([3, 9, 5, 2, 12])
+    streams = split_streams(list(windowed_batches(messages, BATCH_SIZE, WINDOW_LENGTH)))
+
+    found = []
+    for stream in streams:
+        current = None
+        for inputs, targets, reset in stream:
+            if reset:
+                current = ([], [])
+                found.append(current)
+            current[0].extend(inputs)
+            current[1].extend(targets)
+
+    # Fillers are windows of padding with their own reset flag
+    found = [(inputs, targets) for inputs, targets in found if any(inputs)]
+    assert len(found) == len(messages)
+
+    for inputs, targets in found:
+        message = next(message for message in messages if message[0] == inputs[0])
+        length = len(message) - 1
+        padded_length = -(-length // WINDOW_LENGTH) * WINDOW_LENGTH
+
+        assert len(inputs) == padded_length
+        assert list(inputs[:length]) == list(message[:-1])
+        assert list(targets[:length]) == list(message[1:])
+        assert not any(inputs[length:]) and not any(targets[length:])
+
+def test_reset_only_at_message_starts():
+    streams = split_streams(list(windowed_batches(create_messages([9]), BATCH_SIZE, WINDOW_LENGTH)))
+
+    # The message spans two windows of the first stream; the second one continues it.
+    assert [reset for _, _, reset in streams[0]] == [True, False]
+    # The other stream has nothing to train on
+    assert all(reset and not any(inputs) for inputs, _, reset in streams[1])
+
+def test_messages_go_to_the_least_loaded_stream():
+    streams = split_streams(list(windowed_batches(create_messages([13, 3, 3]), BATCH_SIZE, WINDOW_LENGTH)))
+
+    # The first message fills three windows of the first stream, so both short ones go to the second.
+    assert [inputs[0] for inputs, _, reset in streams[1] if reset and any(inputs)] == [101, 201]
+    assert all(not reset for _, _, reset in streams[0][1:])
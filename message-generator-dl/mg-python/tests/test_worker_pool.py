@@ -0,0 +1,45 @@
+import threading
+
+from worker_pool import WorkerPool
+
+def test_handles_all_requests_in_bounded_batches():
+    batches = []
+    lock = threading.Lock()
+
+    def handler(batch):
+        with lock:
+            batches.append(batch)
+
+    pool = WorkerPool(handler, 2, 3)
+    pool.start()
+    for request in range(20):
+        pool.submit(request)
+    pool.close()
+
+    assert sorted(request for batch in batches for request in batch) == list(range(20))
+    assert all(1 <= len(batch) <= 3 for batch in batches)
+    assert pool.queue_depth() == 0
+
+def test_reports_failed_batches_and_keeps_working():
+    handled = []
+    errors = []
+    release = threading.Event()
+
+    def handler(batch):
+        # Holds the worker until all requests are queued, so that they're batched together
+        release.wait()
+        if "bad" in batch:
+            raise ValueError("bad request")
+        handled.extend(batch)
+
+    pool = WorkerPool(handler, 1, 2, lambda request, error: errors.append((request, error)))
+    pool.start()
+    for request in ("first", "bad", "other", "last"):
+        pool.submit(request)
+    release.set()
+    pool.close()
+
+    assert pool.queue_depth() == 0
+    assert "bad" in [request for request, _ in errors]
+    assert all(error == "bad request" for _, error in errors)
+    assert sorted(handled + [request for request, _ in errors]) == ["bad", "first", "last", "other"]
@@ -144,7 +144,7 @@ object TextGenerator {
 		}
 
 		val process = runPython("train.py") {
-			redirectInput(dataset)
+			environment()["DATASET"] = dataset.absolutePath
 			environment()["CHECKPOINT_DIR"] = checkpointDir.absolutePath
 			environment()["PRETRAINED_EMBEDDING"] = pretrainedEmbeddingFile.absolutePath
 			environment()["EPOCHS"] = epochs.toString()
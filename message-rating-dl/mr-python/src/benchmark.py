@@ -0,0 +1,109 @@
+########################################################################
+# Run this script to benchmark the message rating.                     #
+# Without a savefile, a randomly initialized model is used,            #
+# so the benchmark works offline and without training.                 #
+# The results are written as JSON, so they can be compared between     #
+# commits.                                                             #
+########################################################################
+# Accepted env variables:                                              #
+# MODEL_SAVEFILE, VOCAB_SAVEFILE - file pathes. If both are set and    #
+#   exist, the trained model is benchmarked.                           #
+# BENCHMARK_OUTPUT - file path, where to write the results.            #
+#   Defaults to benchmark-rating.json.                                 #
+# BATCH_SIZES - comma-separated integers. Defaults to 1,8,40.          #
+# LENGTHS - comma-separated integers, the message lengths.             #
+#   Defaults to 20,200,2000.                                           #
+# REPEATS - integer, the number of runs per configuration.             #
+#   Defaults to 20.                                                    #
+########################################################################
+
+import json
+import os
+import random
+import resource
+import time
+
+process_start_time = time.time()
+
+import numpy as np
+import tensorflow as tf
+
+from text_rater import TextRater
+from text_rating_model import TextRatingModel
+from common import *
+
+savefile = os.environ.get("MODEL_SAVEFILE")
+vocabfile = os.environ.get("VOCAB_SAVEFILE")
+trained = savefile is not None and vocabfile is not None and os.path.exists(vocabfile)
+output_file = os.environ["BENCHMARK_OUTPUT"] if "BENCHMARK_OUTPUT" in os.environ else "benchmark-rating.json"
+batch_sizes = [int(size) for size in os.environ.get("BATCH_SIZES", "1,8,40").split(",")]
+lengths = [int(length) for length in os.environ.get("LENGTHS", "20,200,2000").split(",")]
+repeats = int(os.environ["REPEATS"]) if "REPEATS" in os.environ else 20
+
+if trained:
+    with open(vocabfile, "r") as file:
+        vocabulary = json.load(file)
+else:
+    vocabulary = [MASK_TOKEN, OOV_TOKEN] + list("abcdefghijklmnopqrstuvwxyz .,!?#")
+
+char_to_id = tf.keras.layers.StringLookup(vocabulary=vocabulary, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+id_to_char = tf.keras.layers.StringLookup(vocabulary=char_to_id.get_vocabulary(), invert=True, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+
+model = TextRatingModel(
+    vocab_size=len(vocabulary),
+    batch_size=BATCH_SIZE,
+    embedding_dim=EMBEDDING_UNITS,
+    rnn_units=RNN_UNITS
+)
+if trained:
+    model.load_weights(savefile)
+
+rater = TextRater(model, id_to_char, char_to_id)
+rater.rate_bucketed(["warm up"])
+
+startup_time = time.time() - process_start_time
+
+def percentiles(values: list[float]) -> dict:
+    return {f"p{p}": float(np.percentile(values, p)) for p in (50, 95, 99)}
+
+# Random messages made of the vocabulary characters
+alphabet = vocabulary[2:]
+def random_message(length: int) -> str:
+    return "".join(random.choices(alphabet, k=length))
+
+results = []
+for length in lengths:
+    for batch_size in batch_sizes:
+        latencies = []
+
+        for _ in range(repeats):
+            texts = [random_message(length) for _ in range(batch_size)]
+
+            start = time.time()
+            rater.rate_bucketed(texts)
+            latencies.append(time.time() - start)
+
+        result = {
+            "batch_size": batch_size,
+            "length": length,
+            "latency": percentiles(latencies),
+            "chars_per_second": length * batch_size * repeats / sum(latencies),
+            "messages_per_second": batch_size * repeats / sum(latencies)
+        }
+
+        print(json.dumps(result))
+        results.append(result)
+
+report = {
+    "model": savefile if trained else "random",
+    "startup_time": startup_time,
+    # ru_maxrss is in kilobytes on linux
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    "results": results
+}
+
+with open(output_file, "w") as file:
+    json.dump(report, file, indent=2)
+
+print(f"Startup time: {startup_time:.3f} s, peak RSS: {report['peak_rss_mb']:.1f} MB")
+print(f"Results written to {output_file}")
@@ -5,3 +5,6 @@ DROPOUT_RATE = 0.0
 
 MASK_TOKEN = '\u0001'
 OOV_TOKEN = '@'
+
+# Messages are grouped by length into these buckets, so that batches aren't padded to a much longer message.
+BUCKET_BOUNDARIES = [16, 32, 64, 128, 256, 512, 1024]
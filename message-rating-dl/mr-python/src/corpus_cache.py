@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+
+# The id of the out-of-vocabulary token. The vocabularies always start with the mask token followed by the oov token.
+OOV_ID = 1
+
+def file_digest(filepath: str) -> str:
+    digest = hashlib.sha256()
+
+    with open(filepath, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+def corpus_key(source_digest: str, vocabulary: list[str] = None) -> str:
+    """
+    Computes the key of a compiled corpus from the digest of its source and, if it's not derived from the source,
+    the vocabulary it's tokenized with.
+    """
+    digest = hashlib.sha256(source_digest.encode('UTF-8'))
+    if vocabulary is not None:
+        digest.update(json.dumps(vocabulary).encode('UTF-8'))
+
+    return digest.hexdigest()
+
+class CompiledCorpus:
+    """
+    A pre-tokenized corpus: token ids of all examples in a flat memory-mapped array,
+    an index of offsets (example i spans tokens[offsets[i]:offsets[i + 1]]), optional labels and the vocabulary.
+    """
+    def __init__(self, directory: str):
+        self.tokens = np.load(os.path.join(directory, "tokens.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(directory, "offsets.npy"), mmap_mode="r")
+
+        labels_file = os.path.join(directory, "labels.npy")
+        self.labels = np.load(labels_file, mmap_mode="r") if os.path.exists(labels_file) else None
+
+        with open(os.path.join(directory, "vocab.json"), "r") as file:
+            self.vocabulary: list[str] = json.load(file)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def examples(self):
+        """
+        Yields the token ids of each example, or tuples of the token ids and the label if the corpus has labels.
+        """
+        for i in range(len(self)):
+            tokens = self.tokens[self.offsets[i]:self.offsets[i + 1]].astype(np.int64)
+
+            if self.labels is not None:
+                yield tokens, self.labels[i]
+            else:
+                yield tokens
+
+def load_corpus(cache_dir: str, key: str) -> CompiledCorpus | None:
+    """
+    Loads a corpus previously compiled with the same key, or returns none if there's no such corpus.
+    """
+    directory = os.path.join(cache_dir, key)
+
+    if not os.path.exists(os.path.join(directory, "vocab.json")):
+        return None
+
+    # Marks the corpus as recently used, see evict_corpora
+    os.utime(os.path.join(directory, "vocab.json"))
+    return CompiledCorpus(directory)
+
+def evict_corpora(cache_dir: str, keep: int, current_key: str):
+    """
+    Deletes the compiled corpora of the cache except for the keep most recently used ones and the current one.
+    Corpora that are still being compiled have no vocabulary yet and are left alone.
+    """
+    corpora = []
+    for key in os.listdir(cache_dir):
+        vocab_file = os.path.join(cache_dir, key, "vocab.json")
+        if key != current_key and os.path.exists(vocab_file):
+            corpora.append((os.path.getmtime(vocab_file), key))
+
+    # The current corpus counts towards the kept ones
+    for _, key in sorted(corpora, reverse=True)[max(0, keep - 1):]:
+        shutil.rmtree(os.path.join(cache_dir, key), ignore_errors=True)
+        print(f"Removed the old compiled corpus {key}")
+
+def compile_corpus(cache_dir: str, key: str, texts, vocabulary: list[str], labels: list[float] = None) -> CompiledCorpus:
+    """
+    Tokenizes the texts and writes them into the cache.
+    :param texts: an iterable of strings, one per example. It's only iterated once.
+    :param labels: if not none, a label for each example.
+    """
+    directory = os.path.join(cache_dir, key)
+    os.makedirs(directory, exist_ok=True)
+
+    char_ids = {char: i for i, char in enumerate(vocabulary)}
+    offsets = [0]
+
+    # The token ids are appended to a raw file first, since the total count isn't known in advance.
+    raw_tokens_file = os.path.join(directory, "tokens.raw")
+    with open(raw_tokens_file, "wb") as file:
+        for text in texts:
+            ids = np.fromiter((char_ids.get(char, OOV_ID) for char in text), dtype=np.int32, count=len(text))
+            file.write(ids.tobytes())
+            offsets.append(offsets[-1] + len(ids))
+
+    tokens = np.lib.format.open_memmap(os.path.join(directory, "tokens.npy"), mode="w+", dtype=np.int32, shape=(offsets[-1],))
+    tokens[:] = np.memmap(raw_tokens_file, dtype=np.int32, mode="r", shape=(offsets[-1],)) if offsets[-1] > 0 else []
+    tokens.flush()
+    del tokens
+    os.remove(raw_tokens_file)
+
+    np.save(os.path.join(directory, "offsets.npy"), np.array(offsets, dtype=np.int64))
+    if labels is not None:
+        np.save(os.path.join(directory, "labels.npy"), np.array(labels, dtype=np.float32))
+
+    # The vocabulary is written last, marking the corpus as complete.
+    with open(os.path.join(directory, "vocab.json"), "w") as file:
+        json.dump(vocabulary, file)
+
+    return CompiledCorpus(directory)
@@ -0,0 +1,44 @@
+########################################################################
+# Run this script to export the model into a ready-to-serve artifact,  #
+# which rate.py can load with the SAVED_MODEL variable.                #
+########################################################################
+# Accepted env variables:                                              #
+# MODEL_SAVEFILE, VOCAB_SAVEFILE - file pathes                         #
+# EXPORT_DIR - file path, the directory to write the artifact into     #
+########################################################################
+
+import json
+import os
+
+import tensorflow as tf
+
+from served_model import ExportedRater
+from text_rater import TextRater
+from text_rating_model import TextRatingModel
+from common import *
+
+if (not 'MODEL_SAVEFILE' in os.environ or not 'VOCAB_SAVEFILE' in os.environ or not 'EXPORT_DIR' in os.environ):
+    print("MODEL_SAVEFILE, VOCAB_SAVEFILE or EXPORT_DIR environment variable are not set")
+    exit(1)
+savefile = os.environ['MODEL_SAVEFILE']
+vocabfile = os.environ['VOCAB_SAVEFILE']
+export_dir = os.environ['EXPORT_DIR']
+
+with open(vocabfile, "r") as file:
+    vocabulary = json.load(file)
+
+char_to_id = tf.keras.layers.StringLookup(vocabulary=vocabulary, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+id_to_char = tf.keras.layers.StringLookup(vocabulary=char_to_id.get_vocabulary(), invert=True, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+
+model = TextRatingModel(
+    vocab_size=len(char_to_id.get_vocabulary()),
+    batch_size=BATCH_SIZE,
+    embedding_dim=EMBEDDING_UNITS,
+    rnn_units=RNN_UNITS
+)
+model.load_weights(savefile)
+
+exported = ExportedRater(TextRater(model, id_to_char, char_to_id))
+tf.saved_model.save(exported, export_dir)
+
+print(f"Exported {savefile} to {export_dir}")
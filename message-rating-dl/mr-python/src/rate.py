@@ -4,58 +4,256 @@
 ########################################################################
 # Accepted env variables:                                              #
 # MODEL_SAVEFILE, VOCAB_SAVEFILE - file pathes                         #
+# SAVED_MODEL - file path of an artifact written by export.py. If set, #
+#   it's served instead of MODEL_SAVEFILE and VOCAB_SAVEFILE.          #
+# PROTOCOL - "text" (default) or "framed". In the framed mode,         #
+#   requests and responses are length-prefixed JSON frames carrying    #
+#   request ids; see protocol.py. Framed requests are always batched.  #
+# BATCH_WINDOW_MS - if set, enables the scheduler mode: requests are   #
+#   collected for up to this many milliseconds and rated in batches.   #
+# MAX_BATCH_SIZE - integer, the maximum size of a batch in the         #
+#   scheduler mode. Defaults to BATCH_SIZE.                            #
+# RATING_CACHE - file path. If set, ratings are cached in memory and   #
+#   in this file, keyed by the message and the model hash.             #
+# RATING_CACHE_SIZE - integer, the maximum number of cached ratings    #
+#   kept in memory. Defaults to 10000.                                 #
+# METRICS_FILE - file path. If set, the time spent in each phase of    #
+#   the requests, the queue depth, the tf.function retracing events,   #
+#   the startup time and the latency of the first request are          #
+#   periodically written there in the Prometheus text format.          #
+# METRICS_PORT - integer. If set, the same metrics are served over     #
+#   http on localhost.                                                 #
+# METRICS_INTERVAL - seconds between the writes of METRICS_FILE.       #
+#   Defaults to 10.                                                    #
+# PROFILE_DIR - directory path. If set, sending SIGUSR1 to the process #
+#   starts the tensorflow profiler, and sending it again stops it.     #
+# RELOAD_COMMANDS - if set and not empty, reload commands are also     #
+#   accepted in the text modes. Only set it if the input never carries #
+#   user text: any message starting with RELOAD:: then loads a model.  #
+#                                                                      #
+# The model can be replaced without restarting with a reload command,  #
+# see below. The new model is loaded and warmed up in the background,  #
+# then swapped in; it must have the same vocabulary size.              #
 ########################################################################
 
 import json
 import os
 import sys
+import threading
 import time
 
+process_start_time = time.time()
+
 import tensorflow as tf
 
-from text_rater import TextRater
-from text_rating_model import TextRatingModel
+from hot_reload import ModelReloader
+import metrics as instrumentation
+from metrics import metrics
+from protocol import FramedChannel
+from rating_cache import RatingCache
+from rating_scheduler import RatingScheduler
+from served_model import load_rater
 from common import *
 
-if (not 'MODEL_SAVEFILE' in os.environ or not 'VOCAB_SAVEFILE' in os.environ):
+if 'SAVED_MODEL' not in os.environ and (not 'MODEL_SAVEFILE' in os.environ or not 'VOCAB_SAVEFILE' in os.environ):
     print("MODEL_SAVEFILE or VOCAB_SAVEFILE environment variable are not set")
     exit(1)
-savefile = os.environ['MODEL_SAVEFILE']
-vocabfile = os.environ['VOCAB_SAVEFILE']
+saved_model = os.environ['SAVED_MODEL'] if 'SAVED_MODEL' in os.environ else None
+protocol = os.environ['PROTOCOL'] if 'PROTOCOL' in os.environ else "text"
+batch_window = int(os.environ['BATCH_WINDOW_MS']) / 1000 if 'BATCH_WINDOW_MS' in os.environ else None
+max_batch_size = int(os.environ['MAX_BATCH_SIZE']) if 'MAX_BATCH_SIZE' in os.environ else BATCH_SIZE
+cachefile = os.environ['RATING_CACHE'] if 'RATING_CACHE' in os.environ else None
+cache_size = int(os.environ['RATING_CACHE_SIZE']) if 'RATING_CACHE_SIZE' in os.environ else 10000
+reload_commands = bool(os.environ['RELOAD_COMMANDS']) if 'RELOAD_COMMANDS' in os.environ else False
 
-# Load the vocabulary
-with open(vocabfile, "r") as file:
-    vocabulary = json.load(file)
+instrumentation.configure_from_environment("rater")
 
-char_to_id = tf.keras.layers.StringLookup(vocabulary=vocabulary, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
-id_to_char = tf.keras.layers.StringLookup(vocabulary=char_to_id.get_vocabulary(), invert=True, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+def validate_rater(new: tuple):
+    new_rater, _ = new
 
-model = TextRatingModel(
-    vocab_size=len(char_to_id.get_vocabulary()),
-    batch_size=BATCH_SIZE,
-    embedding_dim=EMBEDDING_UNITS,
-    rnn_units=RNN_UNITS
-)
-# Load the model
-model.load_weights(savefile)
+    # The vocabulary size of artifacts exported by older versions is unknown
+    if new_rater.vocab_size is not None and rater.vocab_size is not None and new_rater.vocab_size != rater.vocab_size:
+        raise ValueError(f"The new model has {new_rater.vocab_size} characters in its vocabulary, but the current one has {rater.vocab_size}")
 
-rater = TextRater(model, id_to_char, char_to_id)
+def swap_rater(new: tuple):
+    global rater, model_hash
 
-sys.stderr.write("Rating. Type messages to rate them. Delimit with tab followed by a newline.")
+    # In the scheduler modes, the scheduler waits for the current batch itself.
+    with rater_lock:
+        rater, model_hash = new
+        if scheduler is not None:
+            scheduler.swap_rater(rater, model_hash)
+        elif cache is not None:
+            cache.set_model_hash(model_hash)
 
-while True:
+    metrics.increment("reloads")
+    sys.stderr.write("Reloaded the model\n")
+
+rater, model_hash = load_rater({
+    "saved_model": saved_model,
+    "model_savefile": os.environ.get('MODEL_SAVEFILE'),
+    "vocab_savefile": os.environ.get('VOCAB_SAVEFILE')
+})
+reloader = ModelReloader(load_rater, validate_rater, swap_rater)
+# Held while a message is being rated in the unbatched mode, so that the rater isn't replaced in the middle of it.
+rater_lock = threading.Lock()
+scheduler = None
+
+startup_time = time.time() - process_start_time
+metrics.set_gauge("startup_seconds", startup_time)
+sys.stderr.write(f"Startup time: {startup_time} s\n")
+
+cache = RatingCache(cachefile, model_hash, cache_size) if cachefile is not None else None
+if cache is not None:
+    metrics.add_collector(lambda: {"cache_" + key: value for key, value in cache.stats().items()})
+
+first_request_reported = False
+def report_request(time_taken: float):
+    """
+    Reports the latency of the first request after startup.
+    """
+    global first_request_reported
+    if not first_request_reported:
+        first_request_reported = True
+        metrics.set_gauge("first_request_latency_seconds", time_taken)
+        sys.stderr.write(f"First request latency: {time_taken} s\n")
+
+def handle_reload_command(text: str) -> bool:
+    """
+    Starts a reload if a message of the text modes is a reload command.
+    Unless reload commands are enabled, every message is rated.
+    :return: Whether the message was a reload command.
+    """
+    if not reload_commands or not text.startswith("RELOAD::"):
+        return False
+
+    try:
+        reloader.reload(json.loads(text[len("RELOAD::"):]), lambda error: None)
+    except ValueError as e:
+        sys.stderr.write(f"Invalid reload command: {e}\n")
+
+    return True
+
+def read_message() -> str:
     text = ""
     while True:
         text += input()
 
         if text.endswith("\t"):
-            text = text[:-1]
+            return text[:-1]
+
+if protocol == "framed":
+    # Requests are {"id": ..., "text": ...} frames.
+    # Responses are {"id": ..., "rating": ..., "time": ..., "queue_depth": ...} frames, possibly out of order,
+    # or {"id": ..., "error": ...} frames if the batch containing the request couldn't be rated.
+    # {"id": ..., "command": "reload", "model_savefile": ..., "vocab_savefile": ...} frames (or "saved_model" instead of both)
+    # replace the model, and are answered with {"id": ..., "reloaded": true} or {"id": ..., "error": ...}.
+    channel = FramedChannel()
+
+    def write_frame(request, rating, time_taken):
+        report_request(time_taken)
+        channel.write({
+            "id": request.request_id,
+            "rating": rating,
+            "time": time_taken,
+            "queue_depth": scheduler.requests.qsize()
+        })
+
+    scheduler = RatingScheduler(
+        rater, write_frame, max_batch_size, batch_window or 0.0, cache,
+        lambda request, error: channel.write({"id": request.request_id, "error": error})
+    )
+    scheduler.start()
+    metrics.add_collector(lambda: {"queue_depth": scheduler.requests.qsize()})
+
+    sys.stderr.write("Rating in the framed mode.")
+
+    while True:
+        request = channel.read()
+        if request is None:
             break
 
+        if request.get("command") == "reload":
+            reloader.reload(request, lambda error, request_id=request["id"]: channel.write(
+                {"id": request_id, "reloaded": True} if error is None else {"id": request_id, "error": error}
+            ))
+            continue
+
+        metrics.increment("requests")
+
+        if not isinstance(request.get("text"), str):
+            channel.write({"id": request["id"], "error": "The request has no text"})
+            continue
+
+        scheduler.submit(request["id"], request["text"])
+
+    exit(0)
+
+if batch_window is not None:
+    # In the scheduler mode, each message is prefixed with a request id followed by a tab.
+    # Results are written as "id<tab>rating<tab>time s" lines, possibly out of order,
+    # or as "id<tab>error<tab>message" lines if the batch containing the request couldn't be rated.
+    # Reload messages (see below) aren't prefixed with an id.
+    def write_result(request, rating, time_taken):
+        report_request(time_taken)
+        with metrics.time("write"):
+            sys.stdout.write(f"{request.request_id}\t{rating}\t{time_taken} s\n")
+            sys.stdout.flush()
+
+    def write_error(request, error):
+        with metrics.time("write"):
+            # The message mustn't break the line format
+            message = " ".join(error.split())
+            sys.stdout.write(f"{request.request_id}\terror\t{message}\n")
+            sys.stdout.flush()
+
+    scheduler = RatingScheduler(rater, write_result, max_batch_size, batch_window, cache, write_error)
+    scheduler.start()
+    metrics.add_collector(lambda: {"queue_depth": scheduler.requests.qsize()})
+
+    sys.stderr.write("Rating in the scheduler mode. Type request ids and messages separated by a tab. Delimit with tab followed by a newline.")
+
+    while True:
+        text = read_message()
+
+        if handle_reload_command(text):
+            continue
+
+        metrics.increment("requests")
+
+        with metrics.time("parse"):
+            if "\t" not in text:
+                # There's no id to answer
+                sys.stderr.write("Skipped a message without a request id\n")
+                continue
+            request_id, text = text.split("\t", 1)
+        scheduler.submit(request_id, text)
+
+# If reload commands are enabled, a message consisting of `RELOAD::` followed by a reload object replaces the model:
+# {"model_savefile": ..., "vocab_savefile": ...} or {"saved_model": ...}. Nothing is printed; the outcome is reported to stderr.
+sys.stderr.write("Rating. Type messages to rate them. Delimit with tab followed by a newline.")
+
+while True:
+    text = read_message()
+
+    if handle_reload_command(text):
+        continue
+
+    metrics.increment("requests")
+
     start_time = time.time()
+    with rater_lock:
+        with metrics.time("cache_lookup"):
+            rating = cache.get(text) if cache is not None else None
+        if rating is None:
+            with metrics.time("model_call"):
+                rating = float(rater.rate_text(tf.constant([text])).numpy())
 
-    predictions = rater.rate_text(tf.constant([text]))
+            if cache is not None:
+                cache.put(text, rating)
 
-    print(predictions.numpy())
-    print(f"{time.time() - start_time} s")
-    print("   ")
+    report_request(time.time() - start_time)
+    with metrics.time("write"):
+        print(rating)
+        print(f"{time.time() - start_time} s")
+        print("   ")
@@ -0,0 +1,120 @@
+import glob
+import hashlib
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+
+def hash_model_files(savefile: str, vocabfile: str) -> str:
+    """
+    Computes a hash of the model weights and the vocabulary, used to tell apart ratings produced by different models.
+    :param savefile: the savefile prefix passed to load_weights. All files starting with it are hashed.
+    """
+    digest = hashlib.sha256()
+
+    for filepath in sorted(glob.glob(glob.escape(savefile) + "*")) + [vocabfile]:
+        with open(filepath, "rb") as file:
+            for chunk in iter(lambda: file.read(1 << 20), b""):
+                digest.update(chunk)
+
+    return digest.hexdigest()
+
+class RatingCache:
+    """
+    A cache of message ratings, keyed by the normalized message text and the hash of the model that rated it.
+    Recently used entries are kept in memory in LRU order; all entries are also persisted to an sqlite database.
+    """
+    def __init__(self, filepath: str, model_hash: str, max_size: int, report_interval: int = 1000):
+        """
+        :param filepath: path of the on-disk database, created if it doesn't exist.
+        :param max_size: the maximum number of entries kept in memory.
+        :param report_interval: the statistics are written to stderr once per this many lookups.
+        """
+        self.max_size = max_size
+        self.report_interval = report_interval
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self.db = sqlite3.connect(filepath, check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS ratings (model TEXT, text TEXT, rating REAL, PRIMARY KEY (model, text))")
+        self.set_model_hash(model_hash)
+
+    def set_model_hash(self, model_hash: str):
+        """
+        Invalidates all entries produced by other models. Must be called whenever the weights are reloaded.
+        """
+        with self.lock:
+            self.model_hash = model_hash
+            self.entries.clear()
+            self.db.execute("DELETE FROM ratings WHERE model != ?", (model_hash,))
+            self.db.commit()
+
+    def get(self, text: str) -> float | None:
+        with self.lock:
+            rating = self.entries.get(text)
+
+            if rating is not None:
+                self.entries.move_to_end(text)
+            else:
+                row = self.db.execute(
+                    "SELECT rating FROM ratings WHERE model = ? AND text = ?",
+                    (self.model_hash, text)
+                ).fetchone()
+
+                if row is not None:
+                    rating = row[0]
+                    self.remember(text, rating)
+
+            if rating is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+            if (self.hits + self.misses) % self.report_interval == 0:
+                sys.stderr.write(f"Rating cache: {self.stats()}\n")
+
+            return rating
+
+    def put(self, text: str, rating: float):
+        self.put_many([(text, rating)])
+
+    def put_many(self, items: list[tuple[str, float]]):
+        """
+        Adds several entries at once, committing them to the database in a single transaction.
+        :param items: a list of (text, rating) tuples.
+        """
+        with self.lock:
+            for text, rating in items:
+                self.remember(text, rating)
+
+            self.db.executemany(
+                "INSERT OR REPLACE INTO ratings (model, text, rating) VALUES (?, ?, ?)",
+                [(self.model_hash, text, rating) for text, rating in items]
+            )
+            self.db.commit()
+
+    def remember(self, text: str, rating: float):
+        """
+        Adds an entry to the in-memory LRU, evicting the least recently used one if it's full. The lock must be held.
+        """
+        self.entries[text] = rating
+        self.entries.move_to_end(text)
+
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            "size": len(self.entries),
+            "evictions": self.evictions
+        }
@@ -0,0 +1,118 @@
+import queue
+import sys
+import threading
+import time
+
+from metrics import metrics
+from rating_cache import RatingCache
+from text_rater import TextRater
+
+class RatingRequest:
+    def __init__(self, request_id: str, text: str):
+        self.request_id = request_id
+        self.text = text
+        self.received_at = time.time()
+
+class RatingScheduler:
+    """
+    Collects incoming rating requests into micro-batches and rates each batch in a single model call.
+    A batch is dispatched once it's full or once its oldest request has waited for max_delay seconds.
+    """
+    def __init__(self, rater: TextRater, on_result, max_batch_size: int, max_delay: float, cache: RatingCache = None, on_error=lambda request, error: None):
+        """
+        :param on_result: a function accepting a request, its rating and the time in seconds it took to answer it.
+            It's invoked from the scheduler thread.
+        :param on_error: a function accepting a request and an error message, invoked from the scheduler thread
+            for each request of a batch that couldn't be rated.
+        :param cache: if not none, cached ratings are returned without running the model.
+        """
+        self.rater = rater
+        self.cache = cache
+        self.on_result = on_result
+        self.on_error = on_error
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+
+        self.requests = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        # Held while a batch is being rated, so that the rater isn't replaced in the middle of it.
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.thread.start()
+
+    def submit(self, request_id: str, text: str):
+        self.requests.put(RatingRequest(request_id, text))
+
+    def swap_rater(self, rater: TextRater, model_hash: str):
+        """
+        Replaces the rater once the current batch is done, invalidating the cached ratings of the old one.
+        """
+        with self.lock:
+            self.rater = rater
+            if self.cache is not None:
+                self.cache.set_model_hash(model_hash)
+
+    def next_batch(self) -> list[RatingRequest]:
+        """
+        Blocks until at least one request is available, then collects more until the batch is full or the delay runs out.
+        """
+        batch = [self.requests.get()]
+        deadline = batch[0].received_at + self.max_delay
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+
+            try:
+                batch.append(self.requests.get(timeout=remaining))
+            except queue.Empty:
+                break
+
+        return batch
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+
+            dispatched_at = time.time()
+            for request in batch:
+                metrics.observe("queue_wait", dispatched_at - request.received_at)
+            metrics.increment("batches")
+
+            try:
+                ratings = self.rate_batch(batch)
+            except Exception as e:
+                # A failed batch mustn't stop the scheduler, or the requests submitted later would never be answered.
+                sys.stderr.write(f"Failed to rate a batch of {len(batch)} requests: {e}\n")
+                for request in batch:
+                    self.on_error(request, str(e))
+                continue
+
+            end = time.time()
+            for request, rating in zip(batch, ratings):
+                self.on_result(request, rating, end - request.received_at)
+
+    def rate_batch(self, batch: list[RatingRequest]) -> list[float]:
+        """
+        Rates a batch, looking the messages up in the cache first.
+        :return: A list containing a rating for each request, in order.
+        """
+        with self.lock:
+            with metrics.time("cache_lookup"):
+                ratings = [self.cache.get(request.text) if self.cache is not None else None for request in batch]
+
+            # Only the messages that weren't found in the cache are passed to the model.
+            misses = [i for i, rating in enumerate(ratings) if rating is None]
+            if len(misses) > 0:
+                predictions = self.rater.rate_bucketed([batch[i].text for i in misses])
+
+                for i, rating in zip(misses, predictions):
+                    ratings[i] = float(rating)
+
+                # The new ratings are committed at once rather than one by one
+                if self.cache is not None:
+                    self.cache.put_many([(batch[i].text, ratings[i]) for i in misses])
+
+        return ratings
@@ -0,0 +1,81 @@
+import json
+import os
+
+import tensorflow as tf
+
+from rating_cache import hash_model_files
+from text_rater import TextRater
+from text_rating_model import TextRatingModel
+from common import *
+
+class ExportedRater(tf.Module):
+    """
+    A ready-to-serve artifact of a TextRater, written by export.py.
+    Contains the batched rate function with a fixed input signature; the vocabulary lookup is folded into it.
+    """
+    def __init__(self, rater: TextRater):
+        super().__init__()
+
+        self.rater = rater
+        self.vocab_size = tf.Variable(rater.vocab_size, dtype=tf.int32, trainable=False)
+
+    @tf.function(input_signature=[tf.TensorSpec([None], tf.string)])
+    def rate(self, inputs):
+        return self.rater.rate_texts(inputs)
+
+class ServedTextRater(TextRater):
+    """
+    Serves an artifact written by export.py in place of a TextRater built from the savefile.
+    """
+    def __init__(self, path: str):
+        super().__init__(None, None, None)
+
+        self.exported = tf.saved_model.load(path)
+        # Artifacts exported before the vocabulary size was recorded don't have it.
+        if hasattr(self.exported, "vocab_size"):
+            self.vocab_size = int(self.exported.vocab_size.numpy())
+
+    def rate_text(self, inputs) -> tf.Tensor:
+        return self.exported.rate(inputs)[0]
+
+    def rate_texts(self, inputs) -> tf.Tensor:
+        return self.exported.rate(inputs)
+
+def load_rater(source: dict) -> tuple:
+    """
+    Loads and warms up a rater.
+    :param source: a dict containing either the "saved_model" path, or the "model_savefile" and "vocab_savefile" paths.
+    :return: A tuple of the rater and the hash of its files.
+    """
+    if source.get("saved_model"):
+        path = source["saved_model"]
+        rater = ServedTextRater(path)
+        model_hash = hash_model_files(os.path.join(path, "variables", "variables"), os.path.join(path, "saved_model.pb"))
+    else:
+        savefile = source["model_savefile"]
+        vocabfile = source["vocab_savefile"]
+
+        # Load the vocabulary
+        with open(vocabfile, "r") as file:
+            vocabulary = json.load(file)
+
+        char_to_id = tf.keras.layers.StringLookup(vocabulary=vocabulary, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+        id_to_char = tf.keras.layers.StringLookup(vocabulary=char_to_id.get_vocabulary(), invert=True, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
+
+        model = TextRatingModel(
+            vocab_size=len(char_to_id.get_vocabulary()),
+            batch_size=BATCH_SIZE,
+            embedding_dim=EMBEDDING_UNITS,
+            rnn_units=RNN_UNITS
+        )
+        # Load the model
+        model.load_weights(savefile)
+
+        rater = TextRater(model, id_to_char, char_to_id)
+        model_hash = hash_model_files(savefile, vocabfile)
+
+    # Warm up: trace the rating functions before using the rater
+    rater.rate_text(tf.constant(["warm up"]))
+    rater.rate_bucketed(["warm up"])
+
+    return rater, model_hash
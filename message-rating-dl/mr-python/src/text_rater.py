@@ -1,9 +1,25 @@
+import bisect
+import re
 import sys
 import time
+import unicodedata
+
+import numpy as np
 import tensorflow as tf
 
+from metrics import metrics
 from common import *
 
+NON_ASCII = re.compile(r"[^\x00-\x7f]")
+
+def normalize_message(message: str) -> str:
+    """
+    Brings a message to the form the model has been trained on, same as MessageRating.normalizeMessage
+    on the kotlin side, except that emoji are dropped rather than converted.
+    """
+    message = NON_ASCII.sub("", unicodedata.normalize("NFD", message))
+    return message.replace("\t", " ").strip().lower()
+
 class TextRater(tf.keras.Model):
     def __init__(self, model, id_to_char, char_to_id):
         super().__init__()
@@ -11,6 +27,7 @@ class TextRater(tf.keras.Model):
         self.model = model
         self.id_to_char = id_to_char
         self.char_to_id = char_to_id
+        self.vocab_size = len(char_to_id.get_vocabulary()) if char_to_id is not None else None
 
     @tf.function
     def rate_text(self, inputs) -> tf.Tensor:
@@ -19,6 +36,8 @@ class TextRater(tf.keras.Model):
         :param inputs: A rank-1 tensor containing a single string.
         :return: A rank-0 tensor containing the result.
         """
+        metrics.count_trace("rate_text")
+
         # Convert strings to token IDs.
         input_chars = tf.strings.unicode_split(inputs, 'UTF-8')
         input_ids = self.char_to_id(input_chars).to_tensor()
@@ -28,3 +47,37 @@ class TextRater(tf.keras.Model):
         predictions = self.model(input_ids)
 
         return predictions[0][0]
+
+    # Batches of any size and strings of any length share a single trace.
+    @tf.function(input_signature=[tf.TensorSpec([None], tf.string)])
+    def rate_texts(self, inputs) -> tf.Tensor:
+        """
+        Rates a batch of strings at once. Shorter strings are padded with the mask token.
+        :param inputs: A rank-1 tensor of strings.
+        :return: A rank-1 tensor containing a rating for each string.
+        """
+        metrics.count_trace("rate_texts")
+
+        input_chars = tf.strings.unicode_split(inputs, 'UTF-8')
+        input_ids = self.char_to_id(input_chars).to_tensor()
+
+        predictions = self.model(input_ids)
+
+        return predictions[:, 0]
+
+    def rate_bucketed(self, texts: list[str]) -> np.ndarray:
+        """
+        Rates a list of strings, grouping them by length so that short strings aren't padded to the longest one.
+        :return: An array containing a rating for each string, in the original order.
+        """
+        buckets = {}
+        for i, text in enumerate(texts):
+            buckets.setdefault(bisect.bisect_left(BUCKET_BOUNDARIES, len(text)), []).append(i)
+
+        ratings = np.zeros(len(texts), dtype=np.float32)
+        for indices in buckets.values():
+            # Tokenization happens in the same graph as the model call, so they're measured together.
+            with metrics.time("model_call"):
+                ratings[indices] = self.rate_texts(tf.constant([texts[i] for i in indices])).numpy()
+
+        return ratings
@@ -6,8 +6,15 @@
 # MODEL_SAVEFILE, VOCAB_SAVEFILE - file pathes                                                 #
 # RESTORE_STATE - if set and not an empty state, will load the previous state before training. #
 # EPOCHS - An integer, the number of training epochs.                                          #
+# CORPUS_CACHE - directory path. If set, the tokenized dataset is cached there and reused      #
+#   by subsequent runs with the same dataset.                                                  #
+# CORPUS_CACHE_KEEP - integer, the number of compiled corpora kept in CORPUS_CACHE, including  #
+#   the current one; the least recently used ones are deleted. Defaults to 3.                  #
+#   Note that MessageRating.train() randomly drops some of the messages on every run, so its   #
+#   runs rarely reuse a cached corpus.                                                         #
 ################################################################################################
 
+import hashlib
 import json
 import math
 import os
@@ -15,6 +22,7 @@ import sys
 
 import tensorflow as tf
 
+import corpus_cache
 from common import *
 from text_rating_model import TextRatingModel
 
@@ -25,47 +33,71 @@ savefile = os.environ['MODEL_SAVEFILE']
 vocabfile = os.environ['VOCAB_SAVEFILE']
 epochs = int(os.environ['EPOCHS'])
 restore_state = bool(os.environ['RESTORE_STATE']) if 'RESTORE_STATE' in os.environ else False
+corpus_cache_dir = os.environ['CORPUS_CACHE'] if 'CORPUS_CACHE' in os.environ else None
+corpus_cache_keep = int(os.environ['CORPUS_CACHE_KEEP']) if 'CORPUS_CACHE_KEEP' in os.environ else 3
 
 # Read the dataset
-all_lines = list(filter(
-    lambda line: len(line) > 2,
-    sys.stdin.read().split("\t\t")
-))
-
-# for i in range(0, all_lines.__len__(), BATCH_SIZE):
-#     lens = [list(line.split('\t')[0]).__len__() for line in all_lines[i:i+40]]
-#     print(sum(lens)/lens.__len__(), lens)
-# # exit(0)
-
-# Build a vocabulary
-vocabulary = set()
-for line in all_lines:
-    for char in line:
-        vocabulary.add(char)
-if MASK_TOKEN in vocabulary: vocabulary.remove(MASK_TOKEN)
-if OOV_TOKEN in vocabulary: vocabulary.remove(OOV_TOKEN)
-
-vocabulary = [MASK_TOKEN, OOV_TOKEN] + list(sorted(vocabulary))
+raw_dataset = sys.stdin.read()
+
+# The compiled corpus contains the vocabulary, so neither has to be rebuilt if the dataset hasn't changed.
+corpus = None
+if corpus_cache_dir is not None:
+    corpus_key = corpus_cache.corpus_key(hashlib.sha256(raw_dataset.encode('UTF-8')).hexdigest())
+    corpus = corpus_cache.load_corpus(corpus_cache_dir, corpus_key)
+
+if corpus is None:
+    all_lines = list(filter(
+        lambda line: len(line) > 2,
+        raw_dataset.split("\t\t")
+    ))
+
+    # Build a vocabulary
+    vocabulary = set().union(*all_lines)
+    if MASK_TOKEN in vocabulary: vocabulary.remove(MASK_TOKEN)
+    if OOV_TOKEN in vocabulary: vocabulary.remove(OOV_TOKEN)
+
+    vocabulary = [MASK_TOKEN, OOV_TOKEN] + list(sorted(vocabulary))
+
+    # The messages come padded to the longest message in their batch; that padding is stripped here and redone per bucket.
+    texts = [line.split("\t")[0].rstrip(MASK_TOKEN) for line in all_lines]
+    labels = [float(line.split("\t")[1]) for line in all_lines]
+
+    if corpus_cache_dir is not None:
+        print("Compiling the corpus...")
+        # noinspection PyUnboundLocalVariable
+        corpus = corpus_cache.compile_corpus(corpus_cache_dir, corpus_key, texts, vocabulary, labels)
+else:
+    vocabulary = corpus.vocabulary
+
+if corpus_cache_dir is not None:
+    corpus_cache.evict_corpora(corpus_cache_dir, corpus_cache_keep, corpus_key)
 
 print(vocabulary)
 char_to_id = tf.keras.layers.StringLookup(vocabulary=vocabulary, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
 id_to_char = tf.keras.layers.StringLookup(vocabulary=char_to_id.get_vocabulary(), invert=True, mask_token=MASK_TOKEN, oov_token=OOV_TOKEN)
 
 # The dataset
-examples_x = char_to_id(tf.ragged.constant(list(map(
-    lambda line: [char for char in line.split("\t")[0]],
-    all_lines
-))))
-examples_y = list(map(
-    lambda line: float(line.split("\t")[1]),
-    all_lines
-))
+if corpus is not None:
+    example_count = len(corpus)
+    examples = tf.data.Dataset.from_generator(
+        corpus.examples,
+        output_signature=(tf.TensorSpec([None], tf.int64), tf.TensorSpec([], tf.float32))
+    )
+else:
+    example_count = len(texts)
+    examples = tf.data.Dataset.from_tensor_slices((
+        char_to_id(tf.ragged.constant([list(text) for text in texts])),
+        labels
+    ))
 
 dataset = (
-    tf.data.Dataset.from_tensor_slices((examples_x, examples_y))
-        .batch(BATCH_SIZE)
-        .map(lambda input, label: (input.to_tensor(), label)) # This is so dumb. Tensorflow is bullshit.
-        .shuffle(1000, reshuffle_each_iteration=True)
+    examples
+        .shuffle(example_count, reshuffle_each_iteration=True)
+        # Batch messages of similar lengths together, padding each batch only to its own longest message.
+        .bucket_by_sequence_length(
+            element_length_func=lambda input, label: tf.shape(input)[0],
+            bucket_boundaries=BUCKET_BOUNDARIES,
+            bucket_batch_sizes=[BATCH_SIZE] * (len(BUCKET_BOUNDARIES) + 1))
         .prefetch(tf.data.experimental.AUTOTUNE))
 
 model = TextRatingModel(
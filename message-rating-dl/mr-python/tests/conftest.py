@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The scripts import each other as top-level modules, so the tests run with src on the path.
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "src"))
@@ -0,0 +1,49 @@
+import os
+
+from rating_cache import RatingCache
+
+def create_cache(tmp_path, model_hash: str = "model", max_size: int = 2) -> RatingCache:
+    return RatingCache(os.path.join(tmp_path, "ratings.db"), model_hash, max_size)
+
+def test_returns_stored_ratings(tmp_path):
+    cache = create_cache(tmp_path)
+    cache.put("hello", 0.5)
+
+    assert cache.get("hello") == 0.5
+    assert cache.get("missing") is None
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (1, 1)
+
+def test_evicts_the_least_recently_used_entry(tmp_path):
+    cache = create_cache(tmp_path)
+    cache.put("a", 1.0)
+    cache.put("b", 2.0)
+    # Makes "b" the least recently used entry
+    cache.get("a")
+    cache.put("c", 3.0)
+
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.stats()["evictions"] == 1
+    # Evicted entries are still found in the database
+    assert cache.get("b") == 2.0
+
+def test_put_many(tmp_path):
+    cache = create_cache(tmp_path, max_size=10)
+    cache.put_many([("a", 1.0), ("b", 2.0), ("c", 3.0)])
+
+    assert [cache.get(text) for text in ("a", "b", "c")] == [1.0, 2.0, 3.0]
+
+def test_persists_ratings(tmp_path):
+    create_cache(tmp_path).put_many([("a", 1.0), ("b", 2.0)])
+
+    cache = create_cache(tmp_path)
+    assert cache.get("a") == 1.0
+    assert cache.get("b") == 2.0
+
+def test_other_models_ratings_are_invalidated(tmp_path):
+    cache = create_cache(tmp_path)
+    cache.put("a", 1.0)
+
+    cache.set_model_hash("other")
+    assert cache.get("a") is None
+
+    assert create_cache(tmp_path).get("a") is None